@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Benchmarks inspecting the code signatures of executables, as is done when
+adding binaries to Location Services with `--no-check-bin`.
+
+A directory of stand-in executables is created, and `codesign` is replaced with
+a stand-in which waits for a while (as the real one does while it reads the
+signature) before printing a fixed CDHash. The executables are then inspected
+one at a time, concurrently, and again once their CDHashes are cached.
+
+    python benchmarks/bench_codesign.py [--executables 10,50] [--delay 20]
+"""
+
+import argparse
+import os
+import stat
+
+import harness
+from privacy_services_management import cache, code_signature
+
+def build(directory, count):
+    """
+    Creates the stand-in executables.
+
+    :return: a list of their paths
+    """
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, 'tool{}'.format(i))
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\n')
+        paths.append(path)
+    return paths
+
+def stub(directory, delay):
+    """
+    Creates a stand-in codesign which takes 'delay' milliseconds.
+    """
+    path = os.path.join(directory, 'codesign')
+    with open(path, 'w') as f:
+        f.write('#!/bin/sh\n')
+        f.write('sleep {}\n'.format(delay / 1000.0))
+        f.write("echo '{}' 1>&2\n".format(harness.stub_output['codesign']))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+def run(executables, delay, repeat):
+    results = []
+    with harness.TemporaryDirectory() as directory:
+        command = stub(directory, delay)
+
+        for count in executables:
+            tools = os.path.join(directory, 'tools-{}'.format(count))
+            os.makedirs(tools)
+            paths = build(tools, count)
+
+            def forget():
+                code_signature.signatures = cache.PersistentCache(None)
+
+            def serial():
+                for path in paths:
+                    code_signature.inspect(path, command)
+
+            def concurrent():
+                code_signature.lookup_many(paths, command)
+
+            elapsed = [
+                harness.best_of(serial, repeat),
+                harness.best_of(concurrent, repeat, setup=forget),
+            ]
+            forget()
+            concurrent()
+            elapsed.append(harness.best_of(concurrent, repeat))
+            results.append([count] + [harness.milliseconds(x) for x in elapsed])
+
+    harness.print_table(
+        "Code signature inspection (ms, best of {}; codesign takes {} ms)".format(repeat, delay),
+        ['executables', 'one at a time', 'concurrent', 'cached'],
+        results
+    )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark code signature inspection.")
+    parser.add_argument('--executables', type=harness.parse_list, default=[10, 50])
+    parser.add_argument('--delay', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(args.executables, args.delay, args.repeat)
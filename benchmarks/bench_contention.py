@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""
+Benchmarks writing to a TCC database which other processes are writing to at
+the same time.
+
+Several writer processes each make a number of runs against the same user's
+TCC.db, as concurrent login hooks would. Meanwhile another process repeatedly
+takes an exclusive lock on the database and holds it for a while, as tccd
+does. Each configuration of busy timeout and retries is reported with the
+number of runs which failed, how many transactions were retried, and how long
+was spent waiting on locks.
+
+    python benchmarks/bench_contention.py [--writers 2,8] [--runs 20] [--hold 50]
+"""
+
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import time
+
+import harness
+from privacy_services_management import tcc_services
+
+# (label, busy timeout, retries). Python's sqlite3 module waits 5 seconds by
+# default, which is what every write used to rely on.
+configurations = [
+    ('no waiting',      0.0, 0),
+    ('timeout only',    5.0, 0),
+    ('timeout + retry', None, None),
+]
+
+def editor(root_dir, busy_timeout, retries):
+    return tcc_services.TCCEdit(
+        service         = 'contacts',
+        logger          = harness.NullLogger(),
+        user            = 'bench',
+        no_check        = True,
+        no_check_type   = 'bin',
+        version         = 15,
+        root_dir        = root_dir,
+        busy_timeout    = busy_timeout,
+        retries         = retries,
+        autocommit      = False,
+    )
+
+def write(arguments):
+    """
+    Makes one writer's runs.
+
+    :return: a tuple of (failed runs, retried transactions, seconds waited)
+    """
+    root_dir, writer, runs, busy_timeout, retries = arguments
+    failed = 0
+    stats = tcc_services.LockStats()
+    for run in range(runs):
+        apps = ['/usr/local/bin/tool{}-{}-{}'.format(writer, run, i) for i in range(10)]
+        e = None
+        try:
+            e = editor(root_dir, busy_timeout, retries)
+            with e:
+                e.insert_many(apps)
+                e.disable_many(apps)
+        except sqlite3.OperationalError:
+            failed += 1
+        if e:
+            stats.retries += e.lock_stats.retries
+            stats.waited += e.lock_stats.waited
+    return (failed, stats.retries, stats.waited)
+
+def hold(path, seconds, stop):
+    """
+    Repeatedly locks the database exclusively for a while, until stopped.
+    """
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+    while not stop.is_set():
+        connection.execute('BEGIN EXCLUSIVE')
+        time.sleep(seconds)
+        connection.execute('COMMIT')
+        time.sleep(seconds)
+    connection.close()
+
+def run(writers, runs, hold_ms):
+    results = []
+    for count in writers:
+        for label, busy_timeout, retries in configurations:
+            with harness.TemporaryDirectory() as root_dir:
+                os.makedirs(os.path.join(root_dir, 'Users', 'bench', 'Library'))
+                with editor(root_dir, busy_timeout, retries) as e:
+                    # The database is created when it's first used.
+                    e.remove('org.example.placeholder')
+                    path = e.local_path
+
+                stop = multiprocessing.Event()
+                holder = multiprocessing.Process(target=hold, args=(path, hold_ms / 1000.0, stop))
+                holder.start()
+
+                pool = multiprocessing.Pool(count)
+                start = time.time()
+                try:
+                    outcomes = pool.map(write, [(root_dir, i, runs, busy_timeout, retries) for i in range(count)])
+                finally:
+                    pool.close()
+                    pool.join()
+                    stop.set()
+                    holder.join()
+                elapsed = time.time() - start
+
+            results.append([
+                count,
+                label,
+                '{}/{}'.format(sum(x[0] for x in outcomes), count * runs),
+                sum(x[1] for x in outcomes),
+                '{:.2f}'.format(sum(x[2] for x in outcomes)),
+                '{:.2f}'.format(elapsed),
+            ])
+
+    harness.print_table(
+        "Concurrent writers with the database locked for {}ms at a time".format(hold_ms),
+        ['writers', 'configuration', 'failed runs', 'retries', 'lock wait (s)', 'total (s)'],
+        results
+    )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark TCC database lock contention.")
+    parser.add_argument('--writers', type=harness.parse_list, default=[2, 8])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--hold', type=int, default=50)
+    args = parser.parse_args()
+    run(args.writers, args.runs, args.hold)
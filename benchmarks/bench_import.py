@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""
+Benchmarks how long the command line takes to start.
+
+Each case is run in a fresh interpreter, as a shell loop would run it, and the
+wall-clock time of the whole process is reported next to that of an interpreter
+which does nothing at all. The heavier modules loaded by each case are listed
+too, so that an import which creeps back into the start-up path is easy to spot.
+
+    python benchmarks/bench_import.py [--repeat 10]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import harness
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+script = os.path.join(root, 'privacy_services_manager.py')
+
+# Modules which shouldn't be loaded unless they're needed.
+heavy = ['sqlite3', 'subprocess', 'plistlib', 'multiprocessing', 'management_tools']
+
+# Reports which of the heavy modules were loaded once the case has run.
+report = (
+    "import atexit, sys\n"
+    "atexit.register(lambda: sys.stderr.write('loaded: ' + ','.join("
+    "sorted(set(m.split('.')[0] for m in sys.modules if m.split('.')[0] in {heavy!r}))) + '\\n'))\n"
+).format(heavy=heavy)
+
+cases = [
+    ('interpreter only',    "pass"),
+    ('import package',      "import privacy_services_management"),
+    ('--version',           "sys.argv = [{script!r}, '--version']; execfile({script!r}, {{'__name__': '__main__'}})"),
+    ('--help',              "sys.argv = [{script!r}, '--help']; execfile({script!r}, {{'__name__': '__main__'}})"),
+    ('TCC editor',          "import privacy_services_management.tcc_services"),
+    ('locationd editor',    "import privacy_services_management.location_services"),
+]
+
+def run_case(code):
+    """
+    Runs the code in a new interpreter.
+
+    :return: a tuple of the elapsed time and the heavy modules which were loaded
+    """
+    command = [sys.executable, '-c', report + "import sys\n" + code.format(script=script)]
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+    start = time.time()
+    process = subprocess.Popen(command, stdout=open(os.devnull, 'w'), stderr=subprocess.PIPE, env=env, cwd=root)
+    _, errors = process.communicate()
+    elapsed = time.time() - start
+    loaded = [line[len('loaded: '):] for line in errors.decode().splitlines() if line.startswith('loaded: ')]
+    return (elapsed, loaded[-1] if loaded else '?')
+
+def run(repeat):
+    results = []
+    for label, code in cases:
+        times = []
+        for _ in range(repeat):
+            elapsed, loaded = run_case(code)
+            times.append(elapsed)
+        results.append([label, harness.milliseconds(min(times)), loaded or '-'])
+
+    harness.print_table(
+        "Start-up time (ms, best of {})".format(repeat),
+        ['case', 'time', 'heavy modules loaded'],
+        results
+    )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark command line start-up.")
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+    run(args.repeat)
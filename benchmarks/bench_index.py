@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Benchmarks finding a client's grants across every user on a machine.
+
+A stand-in system is built with a number of users, each of whom has a TCC.db
+holding a number of rows. Finding which users have granted one client access
+to Contacts is then timed by reading every user's database, and through the
+grant index: refreshing it when nothing has changed, refreshing it after one
+user's database has changed, and querying it.
+
+    python benchmarks/bench_index.py [--users 10,100] [--rows 100]
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+
+import harness
+from privacy_services_management import grant_index, grants, tcc_services
+
+def build(root_dir, users, rows):
+    """
+    Creates a TCC.db for each of the users, filled with 'rows' unrelated
+    entries.
+
+    :return: a list of the databases' paths
+    """
+    paths = []
+    for i in range(users):
+        home = os.path.join(root_dir, 'Users', 'user{}'.format(i))
+        os.makedirs(os.path.join(home, 'Library'))
+        with tcc_services.TCCEdit(
+            service         = 'contacts',
+            logger          = harness.NullLogger(),
+            home            = home,
+            no_check        = True,
+            no_check_type   = 'bin',
+            version         = 15,
+            root_dir        = root_dir,
+        ) as e:
+            # The database is created when it's first used.
+            e.remove('org.example.placeholder')
+            path = e.local_path
+
+        connection = sqlite3.connect(path)
+        columns = len(connection.execute('SELECT * FROM access LIMIT 0').description)
+        connection.executemany(
+            'INSERT INTO access VALUES ({})'.format(', '.join('?' * columns)),
+            [
+                ('kTCCServiceAddressBook', 'org.example.filler{}'.format(j), 0, 1, 0) + (None,) * (columns - 5)
+                for j in range(rows)
+            ]
+        )
+        connection.commit()
+        connection.close()
+        paths.append(path)
+    return paths
+
+def run(users, rows, repeat):
+    results = []
+    for count in users:
+        with harness.TemporaryDirectory() as root_dir:
+            paths = build(root_dir, count, rows)
+            index = grant_index.GrantIndex(harness.NullLogger(), os.path.join(root_dir, 'grants.db'))
+            index.refresh(root_dir)
+            query = dict(services=['contacts'], clients=['org.example.filler7'])
+
+            def walk():
+                list(grants.dump(harness.NullLogger(), root_dir=root_dir, **query))
+
+            def refresh():
+                index.refresh(root_dir)
+
+            def touch():
+                os.utime(paths[0], (time.time(), time.time() + 1))
+
+            def lookup():
+                list(index.query(root_dir=root_dir, **query))
+
+            results.append([count, rows] + [
+                harness.milliseconds(harness.best_of(walk, repeat)),
+                harness.milliseconds(harness.best_of(refresh, repeat)),
+                harness.milliseconds(harness.best_of(refresh, repeat, setup=touch)),
+                harness.milliseconds(harness.best_of(lookup, repeat)),
+            ])
+            index.close()
+
+    harness.print_table(
+        "Finding one client's grants across users (ms, best of {})".format(repeat),
+        ['users', 'rows', 'read every db', 'refresh (unchanged)', 'refresh (1 changed)', 'indexed query'],
+        results
+    )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the cross-user grant index.")
+    parser.add_argument('--users', type=harness.parse_list, default=[10, 100])
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(args.users, args.rows, args.repeat)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+Benchmarks editing Location Services.
+
+A stand-in locationd directory is built with a clients plist holding a number
+of unrelated entries and a ByHost plist for the (stand-in) hardware UUID. The
+targets are real files, so their code signatures are cached after they're
+first inspected, as they would be on a real system. The `launchctl`, `chown`,
+`codesign`, and `ioreg` commands are replaced with stand-ins which only count
+their invocations, so the benchmark measures this tool's own work and reports
+how many external commands each run needed.
+
+Finding the global plist is also timed with one ByHost plist, and with several,
+when the hardware UUID has to be looked up to choose between them.
+
+    python benchmarks/bench_locationd.py [--entries 100,1000] [--batches 1,10,50]
+"""
+
+import argparse
+import os
+import plistlib
+import time
+
+import harness
+from privacy_services_management import cache, code_signature, location_services
+
+def build(directory, entries):
+    """
+    Creates a stand-in locationd directory.
+    """
+    clients = dict(
+        ('org.example.filler{}'.format(i), {
+            'Authorized':  True,
+            'BundleId':    'org.example.filler{}'.format(i),
+            'Executable':  '/Applications/Filler{}.app/Contents/MacOS/Filler'.format(i),
+            'Hide':        0,
+            'Whitelisted': False,
+        })
+        for i in range(entries)
+    )
+    plistlib.writePlist(clients, os.path.join(directory, 'clients.plist'))
+
+    byhost = os.path.join(directory, 'Library', 'Preferences', 'ByHost')
+    os.makedirs(byhost)
+    uuid = harness.stub_output['ioreg'].split('"')[3]
+    plistlib.writePlist(
+        {'LocationServicesEnabled': 1},
+        os.path.join(byhost, 'com.apple.locationd.{}.plist'.format(uuid))
+    )
+    return byhost
+
+def editor():
+    return location_services.LSEdit(
+        logger          = harness.NullLogger(),
+        no_check        = True,
+        no_check_type   = 'bin',
+        version         = 15,
+    )
+
+def targets(directory, count):
+    """
+    Creates executables to add to Location Services.
+
+    :return: a list of their paths
+    """
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, 'tool{}'.format(i))
+        if not os.path.exists(path):
+            with open(path, 'w') as f:
+                f.write('#!/bin/sh\n# tool {}\n'.format(i))
+            os.chmod(path, int('755', 8))
+        paths.append(path)
+    return paths
+
+def lookups(count):
+    """
+    Finds the global plist a number of times, starting with the hardware UUID
+    unknown.
+
+    :return: the milliseconds taken
+    """
+    location_services._uuid = None
+    location_services._byhost_plists.clear()
+    start = time.time()
+    for _ in range(count):
+        location_services.global_plist_path()
+    return harness.milliseconds(time.time() - start)
+
+def run(entries, batches, repeat):
+    results = []
+    with harness.TemporaryDirectory() as directory:
+        stubs = harness.Stubs(directory, ['launchctl', 'chown', 'codesign', 'ioreg'])
+        location_services.commands.update(stubs.paths)
+        code_signature.signatures = cache.PersistentCache(None)
+        bin_dir = os.path.join(directory, 'bin')
+        os.makedirs(bin_dir)
+
+        for count in entries:
+            locationd_dir = os.path.join(directory, 'locationd-{}'.format(count))
+            os.makedirs(locationd_dir)
+            byhost = build(locationd_dir, count)
+            location_services.locationd_dir = locationd_dir
+
+            for batch in batches:
+                apps = targets(bin_dir, batch)
+
+                def insert():
+                    with editor() as e:
+                        for app in apps:
+                            e.insert(app)
+
+                def remove():
+                    with editor() as e:
+                        for app in apps:
+                            e.remove(app)
+
+                row = [count, batch]
+                for function, setup in ((insert, remove), (insert, None), (remove, insert)):
+                    elapsed = harness.best_of(function, repeat, setup=setup)
+
+                    # Run once more to count the commands used.
+                    if setup:
+                        setup()
+                    stubs.reset()
+                    function()
+                    calls = stubs.counts()
+                    row += [
+                        harness.milliseconds(elapsed),
+                        '{launchctl}/{chown}/{codesign}/{ioreg}'.format(**calls),
+                    ]
+                results.append(row)
+
+        # Finding the global plist doesn't depend on the number of entries.
+        # With a single ByHost plist it's used as it is; once there are several,
+        # the hardware UUID is needed to choose, but it's only looked up once.
+        found = []
+        for label in ('one ByHost plist', 'several ByHost plists'):
+            if label.startswith('several'):
+                plistlib.writePlist(
+                    {'LocationServicesEnabled': 0},
+                    os.path.join(byhost, 'com.apple.locationd.00000000-0000-0000-0000-000000000000.plist')
+                )
+            stubs.reset()
+            elapsed = lookups(10)
+            found.append([label, elapsed, stubs.counts()['ioreg']])
+
+    harness.print_table(
+        "Location Services operations (ms, best of {}; commands run as launchctl/chown/codesign/ioreg)".format(repeat),
+        ['entries', 'batch', 'insert', 'commands', 'insert again', 'commands', 'remove', 'commands'],
+        results
+    )
+
+    print('')
+    harness.print_table(
+        "10 global plist lookups (ms)",
+        ['ByHost directory', 'lookups', 'ioreg runs'],
+        found
+    )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark Location Services editing.")
+    parser.add_argument('--entries', type=harness.parse_list, default=[100, 1000])
+    parser.add_argument('--batches', type=harness.parse_list, default=[1, 10, 50])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(args.entries, args.batches, args.repeat)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+"""
+Benchmarks inserting, removing, and disabling TCC database entries.
+
+A synthetic TCC.db is built for each schema generation that TCCEdit can create
+(Darwin 12; Darwin 13 and 14; Darwin 15 and later) and filled with a number of
+unrelated rows. Each operation is then timed at several batch sizes, both one
+target at a time (as the command line used to do it) and through the bulk
+methods.
+
+    python benchmarks/bench_tcc.py [--rows 100,10000] [--batches 1,10,100]
+"""
+
+import argparse
+import os
+import sqlite3
+
+import harness
+from privacy_services_management import tcc_services
+
+# A representative version of each schema generation.
+generations = [12, 13, 15]
+
+def build(root_dir, version, rows):
+    """
+    Creates a user's TCC.db for the given version under 'root_dir', filled with
+    'rows' unrelated entries.
+
+    :return: the path to the database
+    """
+    home = os.path.join(root_dir, 'Users', 'bench')
+    if not os.path.isdir(os.path.join(home, 'Library')):
+        os.makedirs(os.path.join(home, 'Library'))
+    with editor(root_dir, version) as e:
+        # The database is created when it's first used.
+        e.remove('org.example.placeholder')
+        path = e.local_path
+
+    connection = sqlite3.connect(path)
+    columns = len(connection.execute('SELECT * FROM access LIMIT 0').description)
+    filler = [
+        ('kTCCServiceAddressBook', 'org.example.filler{}'.format(i), 0, 1, 0) + (None,) * (columns - 5)
+        for i in range(rows)
+    ]
+    connection.executemany(
+        'INSERT INTO access VALUES ({})'.format(', '.join('?' * columns)),
+        filler
+    )
+    connection.commit()
+    connection.close()
+    return path
+
+def editor(root_dir, version, autocommit=True):
+    return tcc_services.TCCEdit(
+        service         = 'contacts',
+        logger          = harness.NullLogger(),
+        user            = 'bench',
+        no_check        = True,
+        no_check_type   = 'bin',
+        autocommit      = autocommit,
+        version         = version,
+        root_dir        = root_dir,
+    )
+
+def targets(count):
+    return ['/usr/local/bin/tool{}'.format(i) for i in range(count)]
+
+def run(rows, batches, repeat):
+    results = []
+    for version in generations:
+        for count in rows:
+            with harness.TemporaryDirectory() as root_dir:
+                build(root_dir, version, count)
+                for batch in batches:
+                    apps = targets(batch)
+
+                    def single(method):
+                        def function():
+                            with editor(root_dir, version) as e:
+                                for app in apps:
+                                    getattr(e, method)(app)
+                        return function
+
+                    def bulk(method):
+                        def function():
+                            with editor(root_dir, version) as e:
+                                getattr(e, method + '_many')(apps)
+                        return function
+
+                    def present():
+                        with editor(root_dir, version) as e:
+                            e.insert_many(apps)
+
+                    timings = [
+                        harness.best_of(single('insert'), repeat),
+                        harness.best_of(bulk('insert'), repeat),
+                        harness.best_of(single('disable'), repeat, setup=present),
+                        harness.best_of(bulk('disable'), repeat, setup=present),
+                        harness.best_of(single('remove'), repeat, setup=present),
+                        harness.best_of(bulk('remove'), repeat, setup=present),
+                    ]
+                    results.append(
+                        [version, count, batch] + [harness.milliseconds(t) for t in timings]
+                    )
+
+    harness.print_table(
+        "TCC database operations (ms, best of {})".format(repeat),
+        ['darwin', 'rows', 'batch', 'insert', 'insert_many', 'disable', 'disable_many', 'remove', 'remove_many'],
+        results
+    )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark TCC database editing.")
+    parser.add_argument('--rows', type=harness.parse_list, default=[100, 10000])
+    parser.add_argument('--batches', type=harness.parse_list, default=[1, 10, 100])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(args.rows, args.batches, args.repeat)
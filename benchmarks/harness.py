@@ -0,0 +1,129 @@
+"""
+Shared pieces of the benchmark suite: a quiet logger, timing, stand-in
+executables, and result tables. Nothing here needs OS X; the benchmarks run
+against temporary directories on any Unix-like system.
+"""
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+# Benchmark the working copy, not whatever happens to be installed.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class NullLogger(object):
+    """
+    Stands in for a management_tools.loggers logger, discarding everything so
+    that logging doesn't dominate the timings.
+    """
+    def info(self, message, print_out=True):
+        pass
+
+    def warn(self, message, print_out=True):
+        pass
+
+    def error(self, message, print_out=True):
+        pass
+
+def best_of(function, repeat=3, setup=None):
+    """
+    Times a function, returning the fastest of several runs.
+
+    :param function: the function to time
+    :param repeat: the number of runs
+    :param setup: a function called (untimed) before each run
+    :return: the fastest run, in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+class TemporaryDirectory(object):
+    """
+    A directory which is removed when the 'with' block exits.
+    """
+    def __enter__(self):
+        self.path = tempfile.mkdtemp(prefix='psm-bench-')
+        return self.path
+
+    def __exit__(self, type, value, traceback):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+# What each stand-in executable prints. The ioreg output has the same format as
+# the real thing; codesign (which reports on stderr) gives a fixed CDHash.
+stub_output = {
+    'ioreg':    '  "IOPlatformUUID" = "00000000-1111-2222-3333-444444444444"',
+    'codesign': 'CDHash=0123456789abcdef0123456789abcdef01234567',
+}
+
+class Stubs(object):
+    """
+    A directory of stand-in executables. Each one records its invocation in a
+    shared log so that calls can be counted, prints whatever the real command
+    is expected to print, and succeeds.
+    """
+    def __init__(self, directory, names):
+        self.directory = directory
+        self.log = os.path.join(directory, 'invocations.log')
+        self.paths = {}
+        for name in names:
+            path = os.path.join(directory, name)
+            with open(path, 'w') as f:
+                f.write('#!/bin/sh\n')
+                f.write('echo "{}" >> "{}"\n'.format(name, self.log))
+                if name in stub_output:
+                    f.write("echo '{}' 1>&2\n".format(stub_output[name]))
+            os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+            self.paths[name] = path
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets all recorded invocations.
+        """
+        open(self.log, 'w').close()
+
+    def counts(self):
+        """
+        :return: a dictionary of how many times each stand-in was run
+        """
+        counts = dict((name, 0) for name in self.paths)
+        with open(self.log) as f:
+            for line in f:
+                counts[line.strip()] += 1
+        return counts
+
+def print_table(title, headers, rows):
+    """
+    Prints results as a plain-text table.
+    """
+    widths = [
+        max([len(str(header))] + [len(str(row[i])) for row in rows])
+        for i, header in enumerate(headers)
+    ]
+    print('')
+    print(title)
+    print('  '.join(str(header).rjust(widths[i]) for i, header in enumerate(headers)))
+    print('  '.join('-' * width for width in widths))
+    for row in rows:
+        print('  '.join(str(value).rjust(widths[i]) for i, value in enumerate(row)))
+    sys.stdout.flush()
+
+def milliseconds(seconds):
+    return '{:.2f}'.format(seconds * 1000)
+
+def parse_list(value):
+    """
+    Parses a comma-separated list of integers from the command line.
+    """
+    return [int(x) for x in value.split(',') if x]
@@ -1,3 +1,10 @@
 import universal
+import manifest
+import users
+import images
+import templates
+import timings
+import plan
+import state
 
 __version__ = universal.attributes['version']
@@ -0,0 +1,64 @@
+import os
+import cache
+import timings
+
+# Resolved applications, keyed by whatever string was used to look them up.
+applications = cache.PersistentCache(os.path.join(cache.default_dir(), 'applications.json'))
+
+class CachedAppInfo(object):
+    """
+    The parts of a management_tools AppInfo object which are used by the
+    editors, as remembered by the cache.
+    """
+    def __init__(self, bid, name, path, executable):
+        self.bid        = bid
+        self.name       = name
+        self.path       = path
+        self.executable = executable
+
+def lookup(target):
+    """
+    Resolves an application by short name, bundle identifier, or path. Results
+    are cached, so looking up the same application again (in this run or a
+    later one) is cheap. A cached result is discarded if the application's
+    Info.plist has changed or disappeared since it was cached.
+
+    :param target: the short name, bundle identifier, or path of an application
+    :return: an object with the application's 'bid', 'name', 'path', and
+             'executable'
+    """
+    entry = applications.get(target)
+    if entry and entry['mtime'] == _info_mtime(entry['path']):
+        return CachedAppInfo(entry['bid'], entry['name'], entry['path'], entry['executable'])
+
+    from management_tools.app_info import AppInfo
+    with timings.measure('app_info', target):
+        app = AppInfo(target)
+    info = CachedAppInfo(app.bid, app.name, app.path, app.executable)
+
+    mtime = _info_mtime(app.path)
+    if mtime is not None:
+        applications.set(target, {
+            'bid':        info.bid,
+            'name':       info.name,
+            'path':       info.path,
+            'executable': info.executable,
+            'mtime':      mtime,
+        })
+    return info
+
+def save():
+    """
+    Saves any newly-resolved applications to disk.
+    """
+    applications.save()
+
+def _info_mtime(path):
+    """
+    :return: the modification time of the bundle's Info.plist, or None if there
+             isn't one
+    """
+    try:
+        return os.stat(os.path.join(path, 'Contents', 'Info.plist')).st_mtime
+    except (TypeError, OSError):
+        return None
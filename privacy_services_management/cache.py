@@ -0,0 +1,122 @@
+import json
+import os
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+def default_dir():
+    """
+    :return: the directory where persistent caches are kept; root's caches live
+             in '/Library/Caches', and everyone else's in their own Library
+    """
+    if os.geteuid() == 0:
+        base = '/Library/Caches'
+    else:
+        base = os.path.expanduser('~/Library/Caches')
+    return os.path.join(base, 'privacy_services_manager')
+
+def make_dir(directory):
+    """
+    Creates a cache directory, if it doesn't exist. Caches can hold details of
+    other users' applications and grants, so the directory is only readable by
+    its owner.
+
+    :param directory: the directory to create
+    """
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, int('700', 8))
+
+class PersistentCache(object):
+    """
+    A least-recently-used cache which is kept in memory during a run and saved
+    to a JSON file between runs. Keys must be strings, and values must be
+    serializable as JSON.
+
+    The file is only read the first time the cache is used, and only written by
+    `save()` if something changed. Problems reading or writing the file are not
+    fatal; the cache simply starts out empty (or isn't saved).
+    """
+    def __init__(self, path, max_entries=1000):
+        self.path        = path
+        self.max_entries = max_entries
+        self.entries     = OrderedDict()
+        self.loaded      = False
+        self.dirty       = False
+        self.lock        = threading.RLock()
+
+    def get(self, key):
+        """
+        :return: the value stored for the key, or None
+        """
+        with self.lock:
+            self.__load()
+            if key not in self.entries:
+                return None
+            # Move the entry to the most-recently-used end.
+            value = self.entries.pop(key)
+            self.entries[key] = value
+            return value
+
+    def set(self, key, value):
+        """
+        Stores a value for the key, evicting the least-recently-used entries if
+        the cache is full.
+        """
+        with self.lock:
+            self.__load()
+            self.entries.pop(key, None)
+            self.entries[key] = value
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def delete(self, key):
+        """
+        Removes the key from the cache, if it's there.
+        """
+        with self.lock:
+            self.__load()
+            if self.entries.pop(key, None) is not None:
+                self.dirty = True
+
+    def save(self):
+        """
+        Writes the cache to disk if it has changed. The file is replaced
+        atomically so a concurrent run never reads a partial cache, and is only
+        readable by its owner.
+        """
+        with self.lock:
+            if not self.dirty or not self.path:
+                return
+            try:
+                directory = os.path.dirname(self.path)
+                make_dir(directory)
+                descriptor, temp = tempfile.mkstemp(prefix=os.path.basename(self.path) + '.', suffix='.tmp', dir=directory)
+                with os.fdopen(descriptor, 'w') as f:
+                    json.dump(list(self.entries.items()), f)
+                os.rename(temp, self.path)
+                self.dirty = False
+            except (IOError, OSError):
+                pass
+
+    def __load(self):
+        """
+        Reads the cache from disk the first time it's needed.
+        """
+        if self.loaded:
+            return
+        self.loaded = True
+        if not self.path or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            return
+        # Anything which isn't a list of pairs is discarded.
+        try:
+            loaded = OrderedDict((key, value) for key, value in entries[-self.max_entries:])
+        except (TypeError, ValueError, KeyError):
+            return
+        self.entries.update(loaded)
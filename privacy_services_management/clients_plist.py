@@ -0,0 +1,131 @@
+import copy
+import os
+import plistlib
+import subprocess
+import tempfile
+
+def read_plist(path):
+    """
+    Reads a property list file in-process. Binary property lists are handled
+    natively where plistlib supports them; older versions of plistlib only read
+    XML, so binary files are first converted with `plutil`.
+
+    :param path: the property list file to read
+    :return: the contents of the property list
+    """
+    with open(path, 'rb') as f:
+        contents = f.read()
+
+    if hasattr(plistlib, 'loads'):
+        return plistlib.loads(contents)
+    if contents.startswith('bplist'):
+        contents = subprocess.check_output(
+            ['/usr/bin/plutil', '-convert', 'xml1', '-o', '-', path]
+        )
+    return plistlib.readPlistFromString(contents)
+
+def write_plist(data, path):
+    """
+    Writes a property list file atomically: the contents are written to a
+    temporary file in the same directory, which then replaces the original. The
+    original file's permissions are kept.
+
+    :param data: the contents of the property list
+    :param path: the property list file to write
+    """
+    directory = os.path.dirname(path)
+    handle, temp = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', dir=directory)
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            if hasattr(plistlib, 'dumps'):
+                f.write(plistlib.dumps(data))
+            else:
+                f.write(plistlib.writePlistToString(data))
+        if os.path.exists(path):
+            os.chmod(temp, os.stat(path).st_mode & int('7777', 8))
+        else:
+            os.chmod(temp, int('644', 8))
+        os.rename(temp, path)
+    except:
+        if os.path.exists(temp):
+            os.remove(temp)
+        raise
+
+class ClientsPlist(object):
+    """
+    Holds the locationd clients property list in memory. The file is read once
+    when the object is created; all changes are made to the in-memory copy and
+    written back with a single `save()`.
+
+    The contents as they were read are kept, so that it's possible to tell
+    whether anything has really changed.
+    """
+    def __init__(self, path):
+        self.path = path
+        if os.path.isfile(path):
+            self.data = read_plist(path)
+        else:
+            self.data = {}
+        self.original = copy.deepcopy(self.data)
+
+    def read(self, key):
+        """
+        :return: the entry for the key, or None if it doesn't exist
+        """
+        return self.data.get(key)
+
+    def update(self, key, values):
+        """
+        Sets some of the values in an entry, creating the entry if necessary.
+
+        :param key: the client's key in the property list
+        :param values: a dictionary of values to set in the entry
+        """
+        entry = copy.deepcopy(self.data.get(key, {}))
+        entry.update(values)
+        self.data[key] = entry
+
+    def delete(self, key):
+        """
+        Removes an entry.
+
+        :return: True if the entry existed
+        """
+        return self.data.pop(key, None) is not None
+
+    def changes(self):
+        """
+        :return: a dictionary of the entries which differ from the file as it
+                 was read; entries which were deleted have a value of None
+        """
+        keys = set(self.data.keys()) | set(self.original.keys())
+        return dict(
+            (key, self.data.get(key))
+            for key in keys
+            if self.data.get(key) != self.original.get(key)
+        )
+
+    def changed(self):
+        """
+        :return: whether any entries differ from the file as it was read
+        """
+        return self.data != self.original
+
+    def save(self):
+        """
+        Writes the changed entries back to disk. The file is read again first,
+        so entries which were changed by someone else in the meantime are kept.
+        """
+        if os.path.isfile(self.path):
+            data = read_plist(self.path)
+        else:
+            data = {}
+        for key, entry in self.changes().items():
+            if entry is None:
+                data.pop(key, None)
+            else:
+                data[key] = entry
+        write_plist(data, self.path)
+
+        self.data = data
+        self.original = copy.deepcopy(data)
@@ -0,0 +1,111 @@
+import cache
+import os
+import subprocess
+import timings
+
+# The command used to inspect code signatures, unless another is given.
+default_command = '/usr/bin/codesign'
+
+# The Code Directory Hashes (CDHashes) of the executables inspected so far,
+# keyed by path. Each entry also records the file's inode, size, and
+# modification time, so that a replaced or rebuilt executable is inspected
+# again.
+signatures = cache.PersistentCache(os.path.join(cache.default_dir(), 'signatures.json'))
+
+def lookup(path, command=None):
+    """
+    Finds the CDHash of an executable. Results are cached, so looking up the
+    same executable again (in this run or a later one) is cheap unless the file
+    has changed.
+
+    :param path: the path to the executable
+    :param command: the codesign command to run (default `default_command`)
+    :return: the CDHash, or None if the executable isn't signed
+    """
+    return lookup_many([path], command)[path]
+
+def lookup_many(paths, command=None, jobs=None, plan=None):
+    """
+    Finds the CDHashes of several executables. The executables which aren't
+    cached are inspected concurrently by a bounded pool of workers.
+
+    :param paths: a list of paths to executables
+    :param command: the codesign command to run (default `default_command`)
+    :param jobs: the maximum number of executables inspected at once
+    :param plan: a plan.Plan to count the inspections in
+    :return: a dictionary mapping each path to its CDHash (or None if the
+             executable isn't signed)
+    """
+    results = {}
+    misses = []
+    for path in paths:
+        if path in results or path in misses:
+            continue
+        key = _identity(path)
+        entry = signatures.get(path)
+        if key and entry and entry['identity'] == key:
+            results[path] = entry['cdhash']
+        else:
+            misses.append(path)
+    if not misses:
+        return results
+
+    if plan:
+        plan.command('codesign', len(misses))
+
+    import parallel
+    for path, cdhash, error in parallel.fan_out(lambda x: inspect(x, command), misses, jobs):
+        if error:
+            raise error
+        results[path] = cdhash
+        key = _identity(path)
+        if key:
+            signatures.set(path, {'identity': key, 'cdhash': cdhash})
+    return results
+
+def inspect(path, command=None):
+    """
+    Runs codesign on an executable and reads the CDHash from its output. This
+    is not cached; use `lookup` instead.
+
+    :param path: the path to the executable
+    :param command: the codesign command to run (default `default_command`)
+    :return: the CDHash, or None if the executable isn't signed
+    """
+    # If the command exits with a non-zero exit status, the executable
+    # generally does not have a code signature.
+    try:
+        with timings.measure('codesign', path):
+            output = subprocess.check_output(
+                [command or default_command, '--display', '--verbose=4', path],
+                stderr=subprocess.STDOUT
+            )
+    except subprocess.CalledProcessError:
+        return None
+
+    # There should be exactly one line with the CDHash in it.
+    cdhashes = [
+        line.split('=')[1]
+        for line in output.split('\n')
+        if '=' in line and 'CDHash' in line
+    ]
+    if len(cdhashes) == 1:
+        return cdhashes[0]
+    return None
+
+def save():
+    """
+    Saves any newly-inspected executables to disk.
+    """
+    signatures.save()
+
+def _identity(path):
+    """
+    :return: the file's inode, size, and modification time, or None if it
+             doesn't exist
+    """
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    return [info.st_ino, info.st_size, info.st_mtime]
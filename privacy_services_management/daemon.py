@@ -0,0 +1,234 @@
+import app_cache
+import cache
+import json
+import manifest
+import os
+import signal
+import socket
+import SocketServer
+import stat
+import sys
+import time
+import universal
+
+from collections import OrderedDict
+
+# The most TCC editors (and so open database connections) kept at once.
+max_editors = 32
+
+# How long (in seconds) an invocation waits for the daemon to respond before
+# giving up on it. The daemon handles one request at a time, so a stalled or
+# busy daemon mustn't hold up every invocation.
+default_timeout = 10.0
+
+def default_socket():
+    """
+    :return: where the daemon listens by default; root's daemon uses
+             '/var/run', and everyone else's lives in their cache directory
+    """
+    if os.geteuid() == 0:
+        return '/var/run/privacy_services_manager.sock'
+    return os.path.join(cache.default_dir(), 'daemon.sock')
+
+class Server(SocketServer.UnixStreamServer):
+    """
+    Listens on a Unix domain socket and applies requests one at a time. TCC
+    editors are kept open between requests, along with their connections and
+    the application lookup caches, so a request only pays for the work it asks
+    for.
+
+    Each request is a single line of JSON:
+
+        {"service": "contacts", "action": "add", "apps": ["com.apple.Safari"],
+         "user": "jdoe", "template": false, "language": "English",
+         "forceroot": false, "no_check": false, "no_check_type": null}
+
+    Only the service and action are required. The service may also be a list of
+    services, all of which are modified. Each response is a single line of
+    JSON with "ok" set to true, or set to false with an "error" message.
+    """
+    def __init__(self, path, logger):
+        self.logger = logger
+        self.editors = OrderedDict()
+
+        # Remove a socket left behind by a daemon which is no longer running.
+        # Anything else at the path is left alone.
+        if os.path.lexists(path):
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                raise RuntimeError("'{}' exists and is not a socket.".format(path))
+            if running(path):
+                raise RuntimeError("A daemon is already listening on '{}'.".format(path))
+            os.remove(path)
+        cache.make_dir(os.path.dirname(path))
+
+        # The socket is created without permissions for anyone else, so it's
+        # never open to them, even briefly.
+        umask = os.umask(int('177', 8))
+        try:
+            SocketServer.UnixStreamServer.__init__(self, path, Handler)
+        finally:
+            os.umask(umask)
+        os.chmod(path, int('600', 8))
+
+    def apply(self, request):
+        """
+        Performs one request.
+
+        :param request: a dictionary as described for the class
+        :return: a dictionary describing what was done
+        """
+        apps = request.get('apps') or [None]
+        services = request.get('service')
+        if not isinstance(services, list):
+            services = [services]
+        entries = [
+            manifest.validate(service, request.get('action'), app)
+            for service in services
+            for app in apps
+        ]
+        options = dict(
+            user            = request.get('user') or '',
+            template        = bool(request.get('template')),
+            lang            = request.get('language') or 'English',
+            forceroot       = bool(request.get('forceroot')),
+            no_check        = bool(request.get('no_check')),
+            no_check_type   = request.get('no_check_type'),
+        )
+
+        for database, operations in manifest.group(entries):
+            if database == 'location':
+                # The locationd files are read afresh for every request, since
+                # the system changes them too.
+                with universal.get_editor(service='location', logger=self.logger, **options) as e:
+                    manifest.perform(e, database, operations)
+            else:
+                e = self.__editor(operations[0][0], options)
+                try:
+                    manifest.perform(e, database, operations)
+                    e.commit(database)
+                except:
+                    e.rollback()
+                    raise
+
+        app_cache.save()
+        return {
+            'services': sorted(set(entry[0] for entry in entries)),
+            'action':   entries[0][1],
+            'apps':     [app for app in apps if app],
+        }
+
+    def __editor(self, service, options):
+        """
+        Finds a TCC editor for the options, making one if necessary. Editors
+        whose databases have been replaced or removed are made again.
+        """
+        key = json.dumps(sorted(options.items()))
+        editor = self.editors.pop(key, None)
+        if editor and not editor.current():
+            self.__close(editor)
+            editor = None
+        if not editor:
+            editor = universal.get_editor(service=service, logger=self.logger, autocommit=False, **options)
+        self.editors[key] = editor
+
+        while len(self.editors) > max_editors:
+            self.__close(self.editors.popitem(last=False)[1])
+        return editor
+
+    def __close(self, editor):
+        try:
+            editor.__exit__(None, None, None)
+        except Exception as e:
+            self.logger.error("Failed to close editor: {}".format(e))
+
+    def close(self):
+        """
+        Closes every editor and stops listening.
+        """
+        while self.editors:
+            self.__close(self.editors.popitem()[1])
+        self.server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+class Handler(SocketServer.StreamRequestHandler):
+    """
+    Answers each line of JSON sent over a connection with a line of JSON.
+    """
+    def handle(self):
+        for line in iter(self.rfile.readline, ''):
+            if not line.strip():
+                continue
+            start = time.time()
+            try:
+                request = json.loads(line)
+                self.server.logger.info("Request: {}".format(json.dumps(request, sort_keys=True)))
+                response = self.server.apply(request)
+                response['ok'] = True
+            except Exception as e:
+                self.server.logger.error("{}: {}".format(type(e).__name__, e))
+                response = {'ok': False, 'error': "{}: {}".format(type(e).__name__, e)}
+            response['elapsed'] = round(time.time() - start, 6)
+            self.wfile.write(json.dumps(response, sort_keys=True) + '\n')
+            self.wfile.flush()
+
+def serve(logger, path=None):
+    """
+    Runs the daemon until it is interrupted or terminated.
+
+    :param logger: a management_tools.loggers logger for recording output
+    :param path: the socket to listen on (default: `default_socket()`)
+    """
+    path = path or default_socket()
+    server = Server(path, logger)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    logger.info("Listening on '{}'.".format(path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        logger.info("Stopped listening on '{}'.".format(path))
+
+def running(path=None):
+    """
+    :return: whether a daemon is accepting connections on the socket
+    """
+    path = path or default_socket()
+    if not os.path.exists(path):
+        return False
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(default_timeout)
+    try:
+        s.connect(path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        s.close()
+
+def request(message, path=None, timeout=None):
+    """
+    Sends a request to the daemon and waits for its response.
+
+    :param message: a dictionary as described for `Server`
+    :param path: the daemon's socket (default: `default_socket()`)
+    :param timeout: how long to wait for the response, in seconds (default:
+                    `default_timeout`); if it runs out, socket.timeout is
+                    raised
+    :return: the response, as a dictionary
+    """
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(default_timeout if timeout is None else timeout)
+    try:
+        s.connect(path or default_socket())
+        f = s.makefile('rwb')
+        f.write(json.dumps(message) + '\n')
+        f.flush()
+        line = f.readline()
+    finally:
+        s.close()
+    if not line:
+        raise RuntimeError("The daemon closed the connection without responding.")
+    return json.loads(line)
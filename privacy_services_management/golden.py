@@ -0,0 +1,120 @@
+import cache
+import hashlib
+import json
+import manifest
+import os
+import shutil
+import tempfile
+import universal
+
+# Bump this when the way golden databases are built changes, so that those
+# built the old way are replaced.
+golden_format = 1
+
+def default_dir():
+    """
+    :return: the directory where golden databases are kept
+    """
+    return os.path.join(cache.default_dir(), 'golden')
+
+def generation(version):
+    """
+    Finds the TCC schema generation used for a version of OS X. Every version
+    in a generation gets the same database layout from `TCCEdit`.
+
+    :param version: the Darwin version
+    :return: the first Darwin version of the generation
+    """
+    if version < 13:
+        return 12
+    elif version < 15:
+        return 13
+    return 15
+
+def policy_hash(entries, no_check=False, no_check_type=None):
+    """
+    :param entries: a list of (service, action, client, client_type) tuples,
+                    with each application resolved to its client, so that the
+                    hash changes if an application comes to resolve differently
+    :return: a hash which changes whenever the policy does
+    """
+    policy = {
+        'entries':       [list(entry) for entry in entries],
+        'no_check':      no_check,
+        'no_check_type': no_check_type,
+        'format':        golden_format,
+    }
+    return hashlib.sha1(json.dumps(policy, sort_keys=True).encode('utf-8')).hexdigest()
+
+def database(entries, logger, version=None, no_check=False, no_check_type=None, directory=None):
+    """
+    Finds a golden database: a user's TCC.db for the version's schema
+    generation with the policy already applied. It is built the first time it's
+    needed, and built again if the policy or the schema generation changes.
+    Golden databases for other policies of the same generation are removed.
+
+    :param entries: a list of (service, action, app) tuples, for services
+                    stored in the local databases
+    :param logger: a management_tools.loggers logger for recording output
+    :param version: the Darwin version the database is for (default: the
+                    running system's)
+    :param directory: where golden databases are kept (default: `default_dir()`)
+    :return: the path to the golden database, or None if there are no entries
+    """
+    if not entries:
+        return None
+
+    for service, action, app in entries:
+        if universal.get_database(service) != 'local':
+            raise ValueError("Service '{}' is not stored in the users' databases.".format(service))
+
+    if version is None:
+        version = int(os.uname()[2].split('.')[0])
+    directory = directory or default_dir()
+    cache.make_dir(directory)
+
+    # The database is built in a stand-in home directory, the same way a user's
+    # database would be, and then moved into place.
+    import tcc_services
+    temp = tempfile.mkdtemp(prefix='golden-', dir=directory)
+    try:
+        home = os.path.join(temp, 'home')
+        os.makedirs(os.path.join(home, 'Library'))
+
+        def editor(read_only=False):
+            return tcc_services.TCCEdit(
+                service         = entries[0][0],
+                logger          = logger,
+                home            = home,
+                no_check        = no_check,
+                no_check_type   = no_check_type,
+                autocommit      = False,
+                version         = generation(version),
+                read_only       = read_only,
+            )
+
+        # The applications are looked up first, since the hash is made from
+        # what they resolve to.
+        with editor(read_only=True) as e:
+            resolved = [
+                (service, action) + client
+                for service, action, app in entries
+                for client in (e.resolve([app]) if app else [(None, None)])
+            ]
+        prefix = 'TCC-{}-'.format(generation(version))
+        path = os.path.join(directory, '{}{}.db'.format(prefix, policy_hash(resolved, no_check, no_check_type)))
+        if os.path.isfile(path):
+            return path
+
+        for name in os.listdir(directory):
+            if name.startswith(prefix) and name.endswith('.db'):
+                os.remove(os.path.join(directory, name))
+
+        logger.info("Building golden TCC.db for Darwin {} at '{}'...".format(generation(version), path))
+        with editor() as e:
+            manifest.perform(e, 'local', entries)
+            built = e.local_path
+        os.rename(built, path)
+    finally:
+        shutil.rmtree(temp, ignore_errors=True)
+    return path
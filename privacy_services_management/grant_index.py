@@ -0,0 +1,181 @@
+import cache
+import grants
+import os
+import sqlite3
+
+# The index is kept with the other caches unless another location is given.
+default_name = 'grants.db'
+
+# The layout of the index. Each source is a TCC database or the Location
+# Services clients property list, along with its size and modification time
+# when it was last read (and those of its write-ahead log, if it has one).
+schema = [
+    'CREATE TABLE IF NOT EXISTS sources '
+    '(path TEXT PRIMARY KEY, root TEXT, database TEXT, user TEXT, signature TEXT)',
+    'CREATE TABLE IF NOT EXISTS grants '
+    '(path TEXT, root TEXT, database TEXT, user TEXT, service TEXT, client TEXT, client_type INTEGER, allowed INTEGER)',
+    'CREATE INDEX IF NOT EXISTS grants_by_client ON grants (client, service)',
+    'CREATE INDEX IF NOT EXISTS grants_by_service ON grants (service, client)',
+    'CREATE INDEX IF NOT EXISTS grants_by_path ON grants (path)',
+]
+
+class GrantIndex(object):
+    """
+    Keeps the grants of every user (along with the global TCC database and
+    Location Services) in a single database, so that questions like "which
+    users have allowed this application to use Contacts?" don't require opening
+    every user's TCC database. For example:
+
+        with GrantIndex(logger) as index:
+            index.refresh()
+            for grant in index.query(services=['contacts'], clients=['com.apple.Safari']):
+                print(grant['user'])
+
+    Refreshing the index only reads the sources which have changed since they
+    were last read.
+    """
+    def __init__(self, logger, path=None):
+        self.logger = logger
+        self.path = path or os.path.join(cache.default_dir(), default_name)
+
+        # The index holds every user's grants, which are private to each of
+        # them, so it's only readable by its owner. (SQLite gives its journals
+        # the same permissions.)
+        cache.make_dir(os.path.dirname(self.path))
+        os.close(os.open(self.path, os.O_WRONLY | os.O_CREAT, int('600', 8)))
+        os.chmod(self.path, int('600', 8))
+        self.connection = sqlite3.connect(self.path)
+        for statement in schema:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+    def refresh(self, root_dir='/'):
+        """
+        Brings the index up to date with a system. Sources whose size and
+        modification time haven't changed are skipped, and sources which have
+        disappeared are dropped. A source which changed while it was being read
+        is read again next time. The index is updated in a single transaction.
+
+        :param root_dir: the root of the system (default '/')
+        :return: a tuple of the number of sources read and the number skipped
+        """
+        known = dict(self.connection.execute('SELECT path, signature FROM sources WHERE root IS ?', (root_dir,)))
+        found = grants.sources(root_dir)
+
+        read = 0
+        try:
+            for path, database, user in found:
+                current = signature(path)
+                if path in known and known[path] == current:
+                    continue
+                self.connection.execute('DELETE FROM grants WHERE path IS ?', (path,))
+                try:
+                    rows = [
+                        (path, root_dir, database, user, grant['service'], grant['client'], grant['client_type'], int(grant['allowed']))
+                        for grant in grants.read(path, database, user)
+                    ]
+                except Exception as e:
+                    # Try again next time.
+                    self.logger.error("Could not read '{}': {}".format(path, e))
+                    self.connection.execute('DELETE FROM sources WHERE path IS ?', (path,))
+                    continue
+                # If a write-ahead log appeared or changed during the read, the
+                # rows may be out of date, so no signature is recorded.
+                if signature(path) != current:
+                    current = None
+                self.connection.executemany('INSERT INTO grants VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+                self.connection.execute(
+                    'INSERT or REPLACE INTO sources VALUES (?, ?, ?, ?, ?)',
+                    (path, root_dir, database, user, current)
+                )
+                read += 1
+
+            gone = set(known) - set(path for path, _, _ in found)
+            for path in gone:
+                self.connection.execute('DELETE FROM grants WHERE path IS ?', (path,))
+                self.connection.execute('DELETE FROM sources WHERE path IS ?', (path,))
+            self.connection.commit()
+        except:
+            self.connection.rollback()
+            raise
+
+        self.logger.info("Refreshed the grant index: read {} of {} source(s).".format(read, len(found)))
+        return (read, len(found) - read)
+
+    def query(self, services=None, clients=None, user=None, allowed=None, root_dir=None):
+        """
+        Looks up grants in the index. Lookups by client or service use the
+        index's indexes.
+
+        :param services: a list of services to include (default: all of them)
+        :param clients: a list of clients (bundle identifiers or paths) to
+                        include (default: all of them)
+        :param user: only include grants in this user's database
+        :param allowed: only include grants which are (or aren't) allowed
+        :param root_dir: only include grants in the system under this root
+        :return: a generator of dictionaries, one per grant, as from
+                 `grants.dump`
+        """
+        conditions = []
+        values = []
+        for column, value in (('service', services), ('client', clients)):
+            if value:
+                conditions.append('{} IN ({})'.format(column, ', '.join('?' * len(value))))
+                values += value
+        for column, value in (('user', user), ('root', root_dir)):
+            if value:
+                conditions.append('{} IS ?'.format(column))
+                values.append(value)
+        if allowed is not None:
+            conditions.append('allowed IS ?')
+            values.append(int(bool(allowed)))
+
+        query = 'SELECT database, path, user, service, client, client_type, allowed FROM grants'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY path, service, client'
+
+        for database, path, user, service, client, client_type, allowed in self.connection.execute(query, values):
+            yield {
+                'database':    database,
+                'path':        path,
+                'user':        user,
+                'service':     service,
+                'client':      client,
+                'client_type': client_type,
+                'allowed':     bool(allowed),
+            }
+
+    def close(self):
+        """
+        Closes the index.
+        """
+        self.connection.close()
+
+    def __enter__(self):
+        """
+        Allows for the GrantIndex object to be used in a 'with' clause.
+        """
+        return self
+
+    def __exit__(self, type, value, traceback):
+        """
+        Allows for the GrantIndex object to be used in a 'with' clause.
+        """
+        self.close()
+
+def signature(path):
+    """
+    :return: a string made from the size and modification time of the file and
+             of its write-ahead log (if any), or None if the file doesn't exist
+    """
+    parts = []
+    for name in (path, path + '-wal'):
+        try:
+            info = os.stat(name)
+        except OSError:
+            if name == path:
+                return None
+            continue
+        parts.append('{}:{!r}'.format(info.st_size, info.st_mtime))
+    return ' '.join(parts)
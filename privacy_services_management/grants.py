@@ -0,0 +1,160 @@
+import clients_plist
+import json
+import location_services
+import os
+import tcc_services
+import users
+
+from services import available_services, tcc_database
+
+# The names this program uses for the TCC services, by their TCC names.
+service_names = dict((value[0], key) for key, value in available_services.items())
+
+def dump(logger, services=None, clients=None, user=None, root_dir='/'):
+    """
+    Reads every grant in the global TCC database, each local user's TCC
+    database, and the Location Services clients. The grants are produced one at
+    a time, as they are read, so nothing is held in memory. Nothing is written,
+    and no locks are taken. Sources which can't be read are logged and skipped.
+
+    :param logger: a management_tools.loggers logger for recording errors
+    :param services: a list of services to include (default: all of them)
+    :param clients: a list of clients (bundle identifiers or paths) to include
+                    (default: all of them)
+    :param user: only include the grants in this user's database; the global
+                 database and Location Services are then left out
+    :param root_dir: the root of the system to read (default '/')
+    :return: a generator of dictionaries, one per grant
+    """
+    for path, database, owner in sources(root_dir, user):
+        if database == 'location' and services and 'location' not in services:
+            continue
+        try:
+            for grant in read(path, database, owner, services, clients):
+                yield grant
+        except Exception as e:
+            logger.error("Could not read '{}': {}".format(path, e))
+
+def sources(root_dir='/', user=None):
+    """
+    Finds the places where grants are kept: the global TCC database, each local
+    user's TCC database, and the Location Services clients property list.
+
+    :param root_dir: the root of the system (default '/')
+    :param user: only include this user's database
+    :return: a list of (path, database, user) tuples, where 'database' is
+             'root', 'local', or 'location'
+    """
+    found = []
+    if not user:
+        found.append((os.path.join(root_dir, tcc_database), 'root', None))
+
+    homes = users.local_homes(os.path.join(root_dir, users.homes_dir.lstrip('/')))
+    for name, home in homes:
+        if not user or name == user:
+            found.append((os.path.join(home, tcc_database), 'local', name))
+
+    if not user:
+        found.append((os.path.join(root_dir, location_services.locationd_dir.lstrip('/'), 'clients.plist'), 'location', None))
+    return found
+
+def read(path, database, user=None, services=None, clients=None):
+    """
+    Reads the grants in one of the places found by `sources`.
+
+    :return: a generator of dictionaries, one per grant
+    """
+    if database == 'location':
+        return location_grants(path, clients)
+    return tcc_grants(path, database, user, services, clients)
+
+def tcc_grants(path, database, user=None, services=None, clients=None):
+    """
+    Reads the grants in a TCC database. The database is opened read-only, and
+    the rows are produced as they are fetched. Unless the database has a
+    write-ahead log, it's also opened immutable, so reading never waits for (or
+    holds up) tccd; an immutable connection can't see what's in the log.
+
+    :param path: the location of the database; if it doesn't exist, there are
+                 no grants
+    :param database: 'root' or 'local'
+    :param user: the user whose database it is
+    :param services: a list of services to include (default: all of them)
+    :param clients: a list of clients to include (default: all of them)
+    :return: a generator of dictionaries, one per grant
+    """
+    if not os.path.isfile(path):
+        return
+
+    query = 'SELECT service, client, client_type, {} FROM access'
+    conditions = []
+    values = []
+    if services:
+        names = [available_services[service][0] for service in services if service in available_services]
+        if not names:
+            return
+        conditions.append('service IN ({})'.format(', '.join('?' * len(names))))
+        values += names
+    if clients:
+        conditions.append('client IN ({})'.format(', '.join('?' * len(clients))))
+        values += clients
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+
+    connection = tcc_services.connect_read_only(path, immutable=not os.path.exists(path + '-wal'))
+    try:
+        schema = tcc_services.get_schema(path, connection)
+        for service, client, client_type, granted in connection.execute(query.format(schema.granted()), values):
+            yield {
+                'database':    database,
+                'path':        path,
+                'user':        user,
+                'service':     service_names.get(service, service),
+                'client':      client,
+                'client_type': client_type,
+                'allowed':     bool(granted),
+            }
+    finally:
+        connection.close()
+
+def location_grants(path, clients=None):
+    """
+    Reads the clients of Location Services.
+
+    :param path: the location of the clients property list
+    :param clients: a list of clients (bundle identifiers, or executables'
+                    paths) to include (default: all of them)
+    :return: a generator of dictionaries, one per grant
+    """
+    if not os.path.isfile(path):
+        return
+    prefix = 'com.apple.locationd.executable-'
+    for key, entry in sorted(clients_plist.read_plist(path).items()):
+        if not isinstance(entry, dict):
+            continue
+        client = key[len(prefix):] if key.startswith(prefix) else key
+        if clients and client not in clients and key not in clients:
+            continue
+        yield {
+            'database':    'location',
+            'path':        path,
+            'user':        None,
+            'service':     'location',
+            'client':      client,
+            'client_type': 1 if key.startswith(prefix) else 0,
+            'allowed':     bool(entry.get('Authorized')),
+        }
+
+def write(grants, stream):
+    """
+    Writes grants as JSON, one per line, as they are produced.
+
+    :param grants: an iterable of dictionaries
+    :param stream: the file to write to
+    :return: the number of grants written
+    """
+    count = 0
+    for grant in grants:
+        stream.write(json.dumps(grant, sort_keys=True) + '\n')
+        count += 1
+    return count
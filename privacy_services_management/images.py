@@ -0,0 +1,109 @@
+import glob
+import os
+import manifest
+
+# Where a system keeps its version information, relative to its root.
+system_version_plist = 'System/Library/CoreServices/SystemVersion.plist'
+
+def find_roots(roots=None, globs=None):
+    """
+    Collects the root directories of the systems to modify.
+
+    :param roots: a list of root directories
+    :param globs: a list of shell patterns matching root directories
+    :return: a sorted list of unique, absolute root directories
+    """
+    found = set()
+    for root in roots or []:
+        if not os.path.isdir(root):
+            raise ValueError("Invalid root directory: {}".format(root))
+        found.add(os.path.abspath(root))
+    for pattern in globs or []:
+        matches = [x for x in glob.glob(pattern) if os.path.isdir(x)]
+        if not matches:
+            raise ValueError("No root directories match '{}'.".format(pattern))
+        found.update(os.path.abspath(x) for x in matches)
+    return sorted(found)
+
+def darwin_version(root):
+    """
+    Determines the Darwin version of the system under a root directory from its
+    SystemVersion.plist, e.g. 10.11 is Darwin 15 and 11.0 is Darwin 20.
+
+    :param root: the root directory of the system
+    :return: the Darwin major version, or None if it can't be determined
+    """
+    import clients_plist
+    try:
+        product = clients_plist.read_plist(os.path.join(root, system_version_plist))['ProductVersion']
+        parts = [int(x) for x in product.split('.')[0:2]]
+    except Exception:
+        return None
+
+    if parts[0] == 10 and len(parts) > 1:
+        return parts[1] + 4
+    elif parts[0] >= 11:
+        return parts[0] + 9
+    return None
+
+def apply_roots(roots, entries, logger, jobs=None, user='', template=False, lang='English', no_check=False, no_check_type=None, full_repair=False, version=None, plan=None):
+    """
+    Applies the same operations to the systems under each of the root
+    directories. The roots are modified concurrently; a failure in one does not
+    stop the others.
+
+    :param roots: a list of root directories
+    :param entries: a list of (service, action, app) tuples
+    :param logger: a management_tools.loggers logger for recording output
+    :param jobs: the maximum number of roots modified at once
+    :param version: the Darwin version to assume for roots which don't say
+    :param lang: the User Template to modify, or 'all' for every one of them
+    :param plan: a plan.Plan to record the changes in instead of making them
+    :return: a list of (root, error) tuples, where 'error' is None for each
+             root that was modified successfully
+    """
+    import parallel
+
+    def modify(root):
+        root_version = darwin_version(root) or version
+        if root_version is None:
+            raise RuntimeError("Could not determine the OS X version in '{}'.".format(root))
+        logger.info("Modifying the system in '{}' (Darwin {}).".format(root, root_version))
+        if template and lang == 'all':
+            # The roots are already being modified concurrently, so each
+            # root's templates are done one after another.
+            import templates
+            results = templates.apply_all_languages(
+                entries         = entries,
+                logger          = logger,
+                jobs            = 1,
+                no_check        = no_check,
+                no_check_type   = no_check_type,
+                root_dir        = root,
+                version         = root_version,
+                plan            = plan,
+            )
+            failed = [language for language, error in results if error]
+            if failed:
+                raise RuntimeError("Failed to modify {} of {} User Template(s): {}".format(len(failed), len(results), ', '.join(failed)))
+            return
+        manifest.apply(
+            entries         = entries,
+            logger          = logger,
+            user            = user,
+            template        = template,
+            lang            = lang,
+            no_check        = no_check,
+            no_check_type   = no_check_type,
+            full_repair     = full_repair,
+            root_dir        = root,
+            version         = root_version,
+            plan            = plan,
+        )
+
+    results = []
+    for root, _, error in parallel.fan_out(modify, roots, jobs):
+        if error:
+            logger.error("Failed to modify '{}': {}".format(root, error))
+        results.append((root, error))
+    return results
@@ -1,14 +1,36 @@
+import app_cache
+import cache
+import clients_plist
+import code_signature
 import os
 import subprocess
+import timings
 import universal
 
-try:
-    from management_tools.plist_editor import PlistEditor
-    from management_tools.app_info import AppInfo
-except ImportError as e:
-    print("You need version 1.6.0 or greater of the 'Management Tools' module to be installed first.")
-    print("https://github.com/univ-of-utah-marriott-library-apple/management_tools")
-    raise e
+# The locationd system keeps its data here.
+locationd_dir = '/var/db/locationd'
+# Everything in the locationd directory must belong to this user and group.
+locationd_owner = '_locationd'
+
+# The external commands used to manage locationd. Any of these can be replaced
+# (e.g. with stand-ins that only record being called).
+commands = {
+    'chown':     '/usr/sbin/chown',
+    'codesign':  '/usr/bin/codesign',
+    'ioreg':     '/usr/sbin/ioreg',
+    'launchctl': '/bin/launchctl',
+}
+# The launchd item which runs locationd.
+locationd_plist = '/System/Library/LaunchDaemons/com.apple.locationd.plist'
+
+# The hardware UUID, once it has been looked up.
+_uuid = None
+# A cache.PersistentCache to keep the hardware UUID in between runs. This is
+# off by default, since a cached UUID is wrong if the disk is moved (or imaged)
+# to other hardware.
+uuid_cache = None
+# The ByHost plists found so far, by directory: (directory mtime, plists).
+_byhost_plists = {}
 
 class LSEdit(object):
     """
@@ -21,10 +43,35 @@ class LSEdit(object):
             e.foo()
         # do more stuff
         bar(baz)
+
+    The clients property list is read once and modified in memory. When the
+    'with' block exits, locationd is unloaded, the changes are written in a
+    single pass, and locationd is loaded again. If nothing actually changed,
+    locationd is left running and nothing is written.
+
+    If a root directory other than '/' is given, the locationd directory inside
+    it is modified instead, and the locationd daemon is left alone (since it
+    isn't the one which is running).
+
+    If a plan.Plan is given, nothing is written and locationd is left alone;
+    the changes which would be made are recorded in the plan instead. A
+    read-only editor can be used to find out whether anything would change,
+    but can't commit.
     """
-    def __init__(self, logger, no_check=False, no_check_type=None):
+    def __init__(self, logger, no_check=False, no_check_type=None, full_repair=False, version=None, root_dir='/', plan=None, read_only=False):
         # Set the logger for output.
         self.logger = logger
+
+        # Find the locationd directory within the root directory.
+        self.offline = os.path.abspath(root_dir) != '/'
+        self.locationd_dir = os.path.join(root_dir, locationd_dir.lstrip('/'))
+
+        # Normally only the files written by this editor have their ownership
+        # repaired. A full repair re-owns the whole locationd directory.
+        self.full_repair = full_repair
+        self.written = set()
+        self.plan = plan
+        self.read_only = read_only or plan is not None
     
         # Set the administrative override flag.
         self.no_check = no_check
@@ -32,27 +79,34 @@ class LSEdit(object):
         if self.no_check and no_check_type == 'app':
             raise RuntimeError("Location Services does not support adding applications with the `--no-check-app` flag.")
 
-        # Only root may modify the Location Services system.
-        if os.geteuid() != 0:
+        # Only root may modify the Location Services system. (Or rather, only
+        # root can write to the locationd directory.) A plan only reads it.
+        if not os.access(self.locationd_dir, os.R_OK if self.read_only else os.W_OK):
             raise RuntimeError("Must be root to modify Location Services!")
 
         # Check the version of OS X before continuing; only Darwin versions 10
-        # and above support the location services system.
-        try:
-            version = int(os.uname()[2].split('.')[0])
-        except:
-            raise RuntimeError("Could not acquire the OS X version.")
+        # and above support the location services system. A version can be
+        # given to use instead of the running system's.
+        if version is None:
+            try:
+                version = int(os.uname()[2].split('.')[0])
+            except:
+                raise RuntimeError("Could not acquire the OS X version.")
+        version = int(version)
         if version < 10:
             raise RuntimeError("Location Services is not supported in this version of OS X.")
         self.version = version
 
-        # Disable the locationd launchd item. (Changes will not be properly
-        # cached if this is not done.)
-        self.__disable()
         # This is where the applications' authorizations are stored.
-        self.plist = PlistEditor('/var/db/locationd/clients')
+        self.plist = clients_plist.ClientsPlist(os.path.join(self.locationd_dir, 'clients.plist'))
         self.logger.info("Modifying service 'location' at '{}'.".format(self.plist.path))
 
+        # Whether Location Services should be enabled globally, if requested.
+        self.global_enabled = None
+
+        # The CDHashes of the executables to be inserted, once looked up.
+        self.cdhashes = {}
+
     def insert(self, target):
         """
         Enable the specified target for location services.
@@ -63,8 +117,7 @@ class LSEdit(object):
         # Services system.
         if not target:
             self.logger.info("Enabling service 'location' globally.")
-            enable_global(True, self.logger)
-            self.logger.info("Globally enabled successfully.")
+            self.global_enabled = True
             return
         
         # If we're in admin mode, we can't look up the application as a bundle.
@@ -73,6 +126,17 @@ class LSEdit(object):
         else:
             self.__insert_app(target)
 
+    def insert_many(self, targets):
+        """
+        Enables each of the targets for location services. The executables'
+        code signatures are all inspected up front, concurrently.
+
+        :param targets: a list of applications or files
+        """
+        self.__inspect(targets)
+        for target in targets:
+            self.insert(target)
+
     def remove(self, target):
         """
         Remove an item from Location Services. If no item is given, then disable
@@ -84,25 +148,34 @@ class LSEdit(object):
         # Services system.
         if not target:
             self.logger.info("Disabling service 'location' globally...")
-            enable_global(False, self.logger)
-            self.logger.info("Globally disabled successfully.")
+            self.global_enabled = False
             return
         
         if self.no_check:
             name   = target
             target = 'com.apple.locationd.executable-{}'.format(target)
         else:
-            name   = AppInfo(target).name
-            target = AppInfo(target).bid
+            app    = app_cache.lookup(target)
+            name   = app.name
+            target = app.bid
 
         # Verbosity
         self.logger.info("Removing '{}' from service 'location'...".format(target))
 
         # Otherwise, just delete its entry in the plist.
-        result = self.plist.delete(target)
-        if result:
-            raise RuntimeError("Failed to remove {}.".format(name))
-        self.logger.info("Removed successfully.")
+        if self.plist.delete(target):
+            self.logger.info("Removed successfully.")
+        else:
+            self.logger.warn("'{}' was not in service 'location'.".format(name))
+
+    def remove_many(self, targets):
+        """
+        Removes each of the targets from Location Services.
+
+        :param targets: a list of applications or files
+        """
+        for target in targets:
+            self.remove(target)
 
     def disable(self, target):
         """
@@ -116,36 +189,85 @@ class LSEdit(object):
         # Services system.
         if not target:
             self.logger.info("Disabling service 'location' globally...")
-            enable_global(False, self.logger)
-            self.logger.info("Globally disabled successfully.")
+            self.global_enabled = False
             return
 
-        if self.no_check:
-            name   = target
-            target = 'com.apple.locationd.executable-{}'.format(target)
-        else:
-            name   = AppInfo(target).name
-            target = AppInfo(target).bid
+        name = target
+        key = self.key(target)
 
         # Verboseness
-        self.logger.info("Disabling '{}' in service 'location'...".format(target))
+        self.logger.info("Disabling '{}' in service 'location'...".format(key))
 
         # If the application isn't already in locationd, add it.
-        if not self.plist.read(target):
-            self.insert(target)
+        if not self.plist.read(key):
+            self.insert(name)
 
         # Then deauthorize the application.
-        result = self.plist.dict_add(target, "Authorized", "FALSE", "bool")
-        if result:
-            raise RuntimeError("Failed to disable {}.".format(name))
+        self.plist.update(key, {"Authorized": False})
         self.logger.info("Disabled successfully.")
 
+    def disable_many(self, targets):
+        """
+        Disables each of the targets in Location Services.
+
+        :param targets: a list of applications or files
+        """
+        self.__inspect(targets)
+        for target in targets:
+            self.disable(target)
+
+    def reconcile(self, allow=(), deny=(), exclusive=False, enabled=None):
+        """
+        Brings Location Services in line with a desired state. As with the
+        other changes, nothing is written until the changes are committed, and
+        entries which already match are left as they are.
+
+        :param allow: the applications or files which should be authorized
+        :param deny: the applications or files which should be deauthorized
+        :param exclusive: whether every other entry should be removed
+        :param enabled: whether Location Services should be enabled globally,
+                        or None to leave it alone
+        """
+        self.__inspect(list(allow) + list(deny))
+        for target in allow:
+            self.insert(target)
+        for target in deny:
+            self.disable(target)
+
+        if exclusive:
+            keep = set(self.key(target) for target in list(allow) + list(deny))
+            for key in sorted(self.plist.data):
+                if key not in keep:
+                    self.logger.info("Removing '{}' from service 'location'...".format(key))
+                    self.plist.delete(key)
+
+        if enabled is not None:
+            self.global_enabled = enabled
+
+    def key(self, target):
+        """
+        :return: the key of the target's entry in the clients property list
+        """
+        return client_key(target, self.no_check)
+
+    def __inspect(self, targets):
+        """
+        Looks up the CDHashes of the executables which may be inserted.
+        """
+        if not self.no_check:
+            return
+        self.cdhashes.update(code_signature.lookup_many(
+            [target for target in targets if target and target not in self.cdhashes],
+            command = commands['codesign'],
+            plan    = self.plan
+        ))
+
     def __insert_app(self, target):
         """
         Inserts the specified target application into the locationd plist.
         """
         # Get the AppInfo object for more information.
-        app = AppInfo(target)
+        app = app_cache.lookup(target)
 
         # Verbosity!
         self.logger.info("Inserting '{}' into service 'location'...".format(app.bid))
@@ -155,20 +277,18 @@ class LSEdit(object):
             app.bid, app.bid.split('.')[1]
         ))
 
-        # Write the changes to the locationd plist.
-        result = 0
-        result += self.plist.dict_add(app.bid, "Authorized", "TRUE", "bool")
-        result += self.plist.dict_add(app.bid, "BundleID", app.bid)
-        result += self.plist.dict_add(app.bid, "BundleId", app.bid)
-        result += self.plist.dict_add(app.bid, "BundlePath", app.path)
-        result += self.plist.dict_add(app.bid, "Executable", app.executable)
-        result += self.plist.dict_add(app.bid, "Registered", app.executable)
-        result += self.plist.dict_add(app.bid, "Hide", 0, "int")
-        result += self.plist.dict_add(app.bid, "Requirement", requirement)
-        result += self.plist.dict_add(app.bid, "Whitelisted", "FALSE", "bool")
-        if result:
-            # Clearly there was an error...
-            raise RuntimeError("Failed to insert {}.".format(app.name))
+        # Make the changes to the locationd plist.
+        self.plist.update(app.bid, {
+            "Authorized":  True,
+            "BundleID":    app.bid,
+            "BundleId":    app.bid,
+            "BundlePath":  app.path,
+            "Executable":  app.executable,
+            "Registered":  app.executable,
+            "Hide":        0,
+            "Requirement": requirement,
+            "Whitelisted": False,
+        })
         self.logger.info("Inserted successfully.")
 
     def __insert_executable(self, target):
@@ -181,45 +301,32 @@ class LSEdit(object):
         # Reformat the target name.
         key = 'com.apple.locationd.executable-{}'.format(target)
         
-        # Find the Code Directory Hash (CDHash).
-        # If the command exits with a non-zero exit status, report to the user.
-        # This generally indicates it does not have a code signature.
-        try:
-            codesign = subprocess.check_output(
-                ['/usr/bin/codesign', '--display', '--verbose=4', target],
-                stderr=subprocess.STDOUT
-            ).split('\n')
-        except subprocess.CalledProcessError:
+        # Find the Code Directory Hash (CDHash), unless it was already found.
+        if target not in self.cdhashes:
+            self.__inspect([target])
+        cdhash = self.cdhashes[target]
+        if not cdhash:
             self.logger.warn("Executable '{}' is not signed. Adding anyway...".format(target))
-            codesign = []
-        
-        # Filter the results.
-        codesign = [x for x in codesign if x is not None and x != '']
-        codesign = [x for x in codesign if '=' in x]
-        # After this, 'cdhash' will either be an empty list (no match), or else
-        # it should have one element with the cdhash in it.
-        cdhash = [x.split('=')[1] for x in codesign if 'CDHash' in x]
-        
+
         # Build the requirement string from the cdhash if we have one.
-        if len(cdhash) == 1:
-            requirement = ("cdhash H\"{cdhash}\"".format(cdhash=cdhash[0]))
+        if cdhash:
+            requirement = ("cdhash H\"{cdhash}\"".format(cdhash=cdhash))
         else:
             requirement = None
         
-        # Write the changes to the locationd plist.
-        result = 0
-        result += self.plist.dict_add(key, "Authorized", "TRUE", "bool")
-        result += self.plist.dict_add(key, "BundleID", key)
-        result += self.plist.dict_add(key, "BundleId", key)
-        result += self.plist.dict_add(key, "Executable", target)
-        result += self.plist.dict_add(key, "Registered", target)
-        result += self.plist.dict_add(key, "Hide", 0, "int")
+        # Make the changes to the locationd plist.
+        values = {
+            "Authorized":  True,
+            "BundleID":    key,
+            "BundleId":    key,
+            "Executable":  target,
+            "Registered":  target,
+            "Hide":        0,
+            "Whitelisted": False,
+        }
         if requirement:
-            result += self.plist.dict_add(key, "Requirement", requirement)
-        result += self.plist.dict_add(key, "Whitelisted", "FALSE", "bool")
-        if result:
-            # There was an error.
-            raise RuntimeError("Failed to insert executable {}.".format(target))
+            values["Requirement"] = requirement
+        self.plist.update(key, values)
         self.logger.info("Inserted successfully.")
 
     def __enter__(self):
@@ -231,147 +338,376 @@ class LSEdit(object):
     def __exit__(self, type, value, traceback):
         """
         Allows for the LSEdit object to be used in a 'with' clause.
+
+        Writes any changes (unless an exception was raised) while the locationd
+        system is disabled, then reactivates it.
+        """
+        if type is None:
+            self.commit()
+        # A plan or a read-only editor leaves everything on disk alone,
+        # including the caches.
+        if not self.read_only:
+            app_cache.save()
+            code_signature.save()
+
+    def changed(self):
+        """
+        :return: whether committing would change anything
+        """
+        return self.plist.changed() or self.__global_changed()
+
+    def commit(self):
+        """
+        Writes all of the changes made so far. The locationd system is cycled
+        once to do this, and only if something actually changed.
+        """
+        global_changed = self.__global_changed()
+        if self.plan:
+            self.__plan(global_changed)
+            return
+        if self.read_only and (self.plist.changed() or global_changed):
+            raise RuntimeError("Cannot commit changes to Location Services through a read-only editor.")
+        if not self.plist.changed() and not global_changed:
+            self.logger.info("No changes to Location Services; locationd was left running.")
+            return
+
+        # Disable the locationd launchd item. (Changes will not be properly
+        # cached if this is not done.)
+        self.__disable()
+        try:
+            if self.plist.changed():
+                self.plist.save()
+                self.written.add(self.plist.path)
+                self.logger.info("Saved changes to '{}'.".format(self.plist.path))
+            if global_changed:
+                self.written.add(enable_global(self.global_enabled, self.logger, self.locationd_dir, self.offline))
+                self.logger.info("Globally {} successfully.".format('enabled' if self.global_enabled else 'disabled'))
+            self.global_enabled = None
+        finally:
+            # Make sure that the locationd launchd item is reactivated.
+            self.__enable()
+
+    def __plan(self, global_changed):
         """
-        # Make sure that the locationd launchd item is reactivated.
-        self.__enable()
+        Records in the plan what committing would do, without doing it.
+
+        :param global_changed: whether the global setting would be written
+        """
+        for key, value in sorted(self.plist.changes().items()):
+            if value is None:
+                change = 'remove'
+            elif key in self.plist.original:
+                change = 'update'
+            else:
+                change = 'add'
+            self.plan.change(self.plist.path, key, change)
+        if self.global_enabled is not None:
+            path = global_plist_path(self.locationd_dir, self.offline, self.plan, self.read_only)
+            self.plan.change(path, 'LocationServicesEnabled', 'update' if global_changed else 'unchanged')
+
+        if self.plist.changed() or global_changed:
+            self.plan.commit(self.plist.path)
+            # locationd is unloaded and loaded again, and the ownership of
+            # everything is repaired by `chown -R`, or that of what was written
+            # is repaired in-process.
+            if not self.offline:
+                self.plan.command('launchctl', 2)
+            if self.full_repair:
+                self.plan.command('chown')
+            else:
+                self.plan.reown(int(self.plist.changed()) + int(global_changed))
+        self.global_enabled = None
+
+    def __global_changed(self):
+        """
+        :return: whether a global change was requested which differs from the
+                 current global setting
+        """
+        if self.global_enabled is None:
+            return False
+        try:
+            path = global_plist_path(self.locationd_dir, self.offline, self.plan, self.read_only)
+            current = clients_plist.read_plist(path).get('LocationServicesEnabled')
+        except Exception:
+            # If the current value can't be read, write it anyway.
+            return True
+        return current != (1 if self.global_enabled else 0)
 
     def __enable(self):
         """
-        Enables the locationd system.
+        Enables the locationd system, after repairing the ownership of whatever
+        was written.
         """
-        enable()
-        self.logger.info("Enabled locationd system.")
+        paths = None if self.full_repair else sorted(self.written)
+        if self.offline:
+            if paths is None:
+                repair_all_ownership(self.locationd_dir)
+            else:
+                repair_ownership(paths, self.locationd_dir)
+        else:
+            enable(paths, self.locationd_dir)
+        if paths is None:
+            self.logger.info("Repaired ownership of '{}'.".format(self.locationd_dir))
+        else:
+            self.logger.info("Repaired ownership of {} file(s).".format(len(paths)))
+        self.written.clear()
+        if not self.offline:
+            self.logger.info("Enabled locationd system.")
 
     def __disable(self):
         """
         Disables the locationd system.
         """
+        if self.offline:
+            return
         disable()
         self.logger.info("Disabled locationd system. (This is normal. DON'T PANIC.)")
 
-def enable_global(enable, logger):
+def client_key(target, no_check=False):
+    """
+    :param target: an application, or an executable's path if 'no_check' is set
+    :param no_check: whether the target is an executable rather than a bundle
+    :return: the key of the target's entry in the clients property list
+    """
+    if no_check:
+        return 'com.apple.locationd.executable-{}'.format(target)
+    return app_cache.lookup(target).bid
+
+def enable_global(enable, logger, directory=None, offline=False):
     """
     Enables or disables the Location Services system globally.
     
     :param enable: a boolean describing whether the LS system should be enabled
     :param logger: a management_tools.loggers logger for recording output
+    :param directory: the locationd directory (default '/var/db/locationd')
+    :param offline: whether the directory belongs to a system which isn't
+                    running; if so, the plist is written directly instead of
+                    through `defaults`
+    :return: the path to the plist which was modified
     """
-    # Get the Universally Unique Identifier for the hardware. This determines
-    # the location of the locationd system.
-    uuid = get_uuid()
-    ls_dir = '/var/db/locationd/Library/Preferences/ByHost/'
-    ls_plist = ls_dir + 'com.apple.locationd.' + str(uuid) + '.plist'
-    logger.info("Modifying global values in '" + ls_plist + "'.")
+    path = global_plist_path(directory, offline)
+    logger.info("Modifying global values in '" + path + "'.")
+
+    # Write the location services status (enabled or not).
+    value = 1 if enable else 0
+    if offline:
+        data = clients_plist.read_plist(path)
+        data["LocationServicesEnabled"] = value
+        clients_plist.write_plist(data, path)
+    else:
+        from management_tools.plist_editor import PlistEditor
+        ls_plist = PlistEditor(path)
+        ls_plist.write("LocationServicesEnabled", value, "int")
+    return path
+
+def global_plist_path(directory=None, offline=False, plan=None, read_only=False):
+    """
+    Finds the property list which holds the global Location Services settings.
+
+    :param directory: the locationd directory (default '/var/db/locationd')
+    :param offline: whether the directory belongs to a system which isn't
+                    running, in which case the hardware UUID is unknown
+    :param plan: a plan.Plan to count the hardware lookup in, if one is made
+    :param read_only: whether to leave the hardware UUID cache alone
+    :return: the path to the global locationd plist
+    """
+    ls_dir = os.path.join(directory or locationd_dir, 'Library/Preferences/ByHost')
 
     # Depending on settings, there may be a few possible files to use as the
     # locationd plist.
-    if not os.path.isfile(ls_plist):
-        ls_plist = None
-        # Find everything starting with 'com.apple.locationd' and ending with
-        # the '.plist' extension.
-        potentials = [
-            x.lstrip('com.apple.locationd.').rstrip('.plist')
-            for x in os.listdir(ls_dir)
-            if str(x).endswith('.plist')
-            and str(x).startswith('com.apple.locationd.')
-        ]
-        potentials = [x for x in potentials if not x.find('.') >= 0]
-        
-        # Must handle things differently depending on the number of results.
-        if len(potentials) > 1:
-            # Out of all the matches, try to find the one that matches the UUID.
-            for id in potentials:
-                if uuid == id or uuid.lower() == id or uuid.upper() == id:
-                    ls_plist = ('{}com.apple.locationd.{}.plist'.format(ls_dir, id))
-                    break
-                
-                for part in uuid.split('-'):
-                    if part == id or part.lower() == id or part.upper() == id:
-                        ls_plist = ('{}com.apple.locationd.{}.plist'.format(ls_dir, id))
-                        break
-                
-                # If we've found it, break out of this loop.
-                if ls_plist:
-                    break
-        elif len(potentials) == 1:
-            # Only one result - that's easy!
-            ls_plist = (ls_dir + 'com.apple.locationd.{}.plist'.format(potentials[0]))
-        else:
-            raise RuntimeError("No Location Services global property list found at '{}'.".format(ls_plist))
+    plists = byhost_plists(ls_dir)
 
-    # Write the location services status (enabled or not).
-    if ls_plist:
-        ls_plist = PlistEditor(ls_plist)
-        value = 1 if enable else 0
-        ls_plist.write("LocationServicesEnabled", value, "int")
-    else:
-        raise RuntimeError("Could not locate Location Services plist file at '{}.".format(ls_plist))
+    # Must handle things differently depending on the number of results.
+    if len(plists) == 1:
+        # Only one result - that's easy!
+        return list(plists.values())[0]
+    elif not plists:
+        raise RuntimeError("No Location Services global property list found in '{}'.".format(ls_dir))
+    elif offline:
+        raise RuntimeError("Cannot tell which global property list to use in '{}'.".format(ls_dir))
+
+    # Get the Universally Unique Identifier for the hardware. This determines
+    # the location of the locationd system.
+    uuid = get_uuid(plan, read_only)
+    for id in (uuid, uuid.lower(), uuid.upper()):
+        if id in plists:
+            return plists[id]
 
-def get_uuid():
+    # Out of all the matches, try to find one that matches part of the UUID.
+    for part in uuid.split('-'):
+        for id in (part, part.lower(), part.upper()):
+            if id in plists:
+                return plists[id]
+
+    raise RuntimeError("Could not locate Location Services plist file in '{}'.".format(ls_dir))
+
+def byhost_plists(directory):
     """
-    Acquire the Universally Unique Identifier of the hardware.
+    Finds the locationd plists in a ByHost directory, i.e. the files named like
+    'com.apple.locationd.<id>.plist'. The directory is only scanned again if it
+    has been modified since the last time.
+
+    :param directory: the ByHost directory to look in
+    :return: a dictionary mapping each plist's ID to its path
     """
+    mtime = os.stat(directory).st_mtime
+    if directory in _byhost_plists and _byhost_plists[directory][0] == mtime:
+        return _byhost_plists[directory][1]
+
+    prefix = 'com.apple.locationd.'
+    suffix = '.plist'
+    plists = {}
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith(suffix):
+            id = name[len(prefix):-len(suffix)]
+            if id and '.' not in id:
+                plists[id] = os.path.join(directory, name)
+
+    _byhost_plists[directory] = (mtime, plists)
+    return plists
+
+def get_uuid(plan=None, read_only=False):
+    """
+    Acquire the Universally Unique Identifier of the hardware. It's only looked
+    up once per run. If `uuid_cache` is set, it is also remembered between runs.
+
+    :param plan: a plan.Plan to count the lookup in, if one is made
+    :param read_only: whether to leave `uuid_cache` alone (as it is whenever
+                      there's a plan)
+    """
+    global _uuid
+    if _uuid:
+        return _uuid
+    if uuid_cache:
+        _uuid = uuid_cache.get('uuid')
+        if _uuid:
+            return _uuid
+
     ioreg = [
-        '/usr/sbin/ioreg',
+        commands['ioreg'],
         '-rd1',
         '-c',
         'IOPlatformExpertDevice'
     ]
 
-    uuid = subprocess.check_output(ioreg, stderr=subprocess.STDOUT).split('\n')
+    if plan:
+        plan.command('ioreg')
+    with timings.measure('ioreg'):
+        uuid = subprocess.check_output(ioreg, stderr=subprocess.STDOUT).split('\n')
     uuid = [x for x in uuid if x.find('UUID') >= 0]
 
     if len(uuid) != 1:
         raise RuntimeError("Could not find a unique UUID.")
 
-    return uuid[0].lstrip().rstrip('"').split('= "')[1]
+    _uuid = uuid[0].lstrip().rstrip('"').split('= "')[1]
+    if uuid_cache and not (read_only or plan):
+        uuid_cache.set('uuid', _uuid)
+        uuid_cache.save()
+    return _uuid
+
+def cache_uuid(path=None):
+    """
+    Keeps the hardware UUID on disk between runs.
+
+    :param path: where to keep the UUID; defaults to the cache directory
+    """
+    global uuid_cache
+    uuid_cache = cache.PersistentCache(path or os.path.join(cache.default_dir(), 'hardware.json'))
 
-def enable():
+def enable(paths=None, directory=None):
     """
     Fix permissions for the _locationd user, then load the locationd launchd
     daemon item.
-    """
-    chown = [
-        '/usr/sbin/chown',
-        '-R',
-        '_locationd:_locationd',
-        '/var/db/locationd'
-    ]
 
-    result = subprocess.call(
-        chown,
-        stderr=subprocess.STDOUT,
-        stdout=open(os.devnull, 'w')
-    )
-    if result != 0:
-        raise RuntimeError("Unable to repair permissions: '/var/db/locationd'!")
+    :param paths: the files whose ownership should be repaired; if not given,
+                  the whole locationd directory is repaired recursively
+    :param directory: the locationd directory (default '/var/db/locationd')
+    """
+    if paths is None:
+        repair_all_ownership(directory)
+    else:
+        repair_ownership(paths, directory)
 
     launchctl = [
-        '/bin/launchctl',
+        commands['launchctl'],
         'load',
-        '/System/Library/LaunchDaemons/com.apple.locationd.plist'
+        locationd_plist
     ]
 
-    output = subprocess.check_output(
-        launchctl,
-        stderr=subprocess.STDOUT
-    ).strip('\n')
+    with timings.measure('launchctl', 'load'):
+        output = subprocess.check_output(
+            launchctl,
+            stderr=subprocess.STDOUT
+        ).strip('\n')
 
     return output
 
+def repair_ownership(paths, directory=None):
+    """
+    Gives the specified files back to the _locationd user and group.
+
+    :param paths: a list of files inside the locationd directory
+    :param directory: the locationd directory (default '/var/db/locationd')
+    """
+    if not paths:
+        return
+    uid, gid = locationd_ids(directory)
+    for path in paths:
+        with timings.measure('chown', path):
+            os.chown(path, uid, gid)
+
+def repair_all_ownership(directory=None):
+    """
+    Gives everything in the locationd directory back to the _locationd user and
+    group. This walks the whole directory, which can take a while.
+
+    :param directory: the locationd directory (default '/var/db/locationd')
+    """
+    directory = directory or locationd_dir
+    chown = [
+        commands['chown'],
+        '-R',
+        '{0}:{0}'.format(locationd_owner),
+        directory
+    ]
+
+    with timings.measure('chown', directory):
+        result = subprocess.call(
+            chown,
+            stderr=subprocess.STDOUT,
+            stdout=open(os.devnull, 'w')
+        )
+    if result != 0:
+        raise RuntimeError("Unable to repair permissions: '{}'!".format(directory))
+
+def locationd_ids(directory=None):
+    """
+    :return: a tuple of the user ID and group ID which own the locationd files;
+             if there is no _locationd user, those of the locationd directory
+             itself are used
+    """
+    import grp
+    import pwd
+    try:
+        return (pwd.getpwnam(locationd_owner).pw_uid, grp.getgrnam(locationd_owner).gr_gid)
+    except KeyError:
+        info = os.stat(directory or locationd_dir)
+        return (info.st_uid, info.st_gid)
+
 def disable():
     """
     Unload the locationd launchd daemon item.
     """
     launchctl = [
-        '/bin/launchctl',
+        commands['launchctl'],
         'unload',
-        '/System/Library/LaunchDaemons/com.apple.locationd.plist'
+        locationd_plist
     ]
 
-    output = subprocess.check_output(
-        launchctl,
-        stderr=subprocess.STDOUT
-    ).strip('\n')
+    with timings.measure('launchctl', 'unload'):
+        output = subprocess.check_output(
+            launchctl,
+            stderr=subprocess.STDOUT
+        ).strip('\n')
 
     return output
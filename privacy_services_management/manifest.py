@@ -0,0 +1,169 @@
+import csv
+import itertools
+import json
+import sys
+import universal
+
+# Manifests are applied in this order so that the slow Location Services work
+# happens last, after the TCC databases have been committed.
+database_order = ['root', 'local', 'location']
+
+def read(source):
+    """
+    Reads a manifest of operations. Each operation names a service, an action,
+    and (optionally) an application. Manifests may be given either as JSON:
+
+        [
+            {"service": "contacts", "action": "add", "app": "com.apple.Safari"},
+            {"service": "location", "action": "enable"}
+        ]
+
+    or as lines of comma- or whitespace-separated values:
+
+        contacts, add, com.apple.Safari
+        calendar  add  /Applications/Google Chrome.app
+
+    Blank lines and lines starting with '#' are ignored.
+
+    :param source: a path to a manifest file, or '-' to read from stdin
+    :return: a list of (service, action, app) tuples
+    """
+    if source == '-':
+        text = sys.stdin.read()
+    else:
+        with open(source) as f:
+            text = f.read()
+
+    if text.lstrip().startswith(('[', '{')):
+        entries = _read_json(text)
+    else:
+        entries = _read_lines(text)
+
+    return [validate(*entry) for entry in entries]
+
+def group(entries):
+    """
+    Sorts the manifest's operations by the database which they modify. Each
+    group can then be applied as a single transaction.
+
+    :param entries: a list of (service, action, app) tuples
+    :return: a list of (database, entries) tuples
+    """
+    groups = dict((database, []) for database in database_order)
+    for service, action, app in entries:
+        groups[universal.get_database(service)].append((service, action, app))
+    return [(database, groups[database]) for database in database_order if groups[database]]
+
+def apply(entries, logger, user='', template=False, lang='English', forceroot=False, no_check=False, no_check_type=None, full_repair=False, root_dir='/', version=None, plan=None):
+    """
+    Applies every operation in the manifest. Operations are grouped by their
+    database so that each TCC database is committed only once, and Location
+    Services is modified in a single editing session. Both TCC databases are
+    modified through a single editor, which only connects to the databases the
+    operations actually use.
+
+    :param entries: a list of (service, action, app) tuples
+    :param logger: a management_tools.loggers logger for recording output
+    :param root_dir: the root of the system to modify (default '/')
+    :param version: the Darwin version of that system, if it isn't running
+    :param plan: a plan.Plan to record the changes in instead of making them
+    """
+    groups = group(entries)
+    tcc_groups = [(database, operations) for database, operations in groups if database != 'location']
+    location_groups = [(database, operations) for database, operations in groups if database == 'location']
+
+    def editor(service):
+        return universal.get_editor(
+            service         = service,
+            logger          = logger,
+            user            = user,
+            template        = template,
+            lang            = lang,
+            forceroot       = forceroot,
+            no_check        = no_check,
+            no_check_type   = no_check_type,
+            autocommit      = False,
+            full_repair     = full_repair,
+            root_dir        = root_dir,
+            version         = version,
+            plan            = plan,
+        )
+
+    if tcc_groups:
+        with editor(tcc_groups[0][1][0][0]) as e:
+            for database, operations in tcc_groups:
+                logger.info("Applying {} operation(s) to the '{}' database...".format(len(operations), database))
+                perform(e, database, operations)
+                e.commit(database)
+                logger.info("Committed changes to the '{}' database.".format(database))
+
+    for database, operations in location_groups:
+        logger.info("Applying {} operation(s) to the '{}' database...".format(len(operations), database))
+        with editor('location') as e:
+            perform(e, database, operations)
+        logger.info("Committed changes to the '{}' database.".format(database))
+
+def perform(editor, database, operations):
+    """
+    Carries out a group of operations on one database, without committing them.
+
+    :param editor: an editor for the database, as from `universal.get_editor`
+    :param database: the database which the operations modify
+    :param operations: a list of (service, action, app) tuples
+    """
+    # Consecutive operations of the same kind are done together.
+    for (service, action), run in itertools.groupby(operations, lambda x: x[0:2]):
+        method = getattr(editor, universal.action_methods[action] + '_many')
+        if database == 'location':
+            method([app for service, action, app in run])
+        else:
+            method([app for service, action, app in run], service)
+
+def _read_json(text):
+    """
+    Produces (service, action, app) tuples from a JSON manifest.
+    """
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = [data]
+
+    for item in data:
+        if isinstance(item, dict):
+            apps = item.get('apps', [item.get('app')])
+            for app in apps or [None]:
+                yield (item.get('service'), item.get('action'), app)
+        else:
+            item = list(item)
+            yield tuple(item + [None] * (3 - len(item)))
+
+def _read_lines(text):
+    """
+    Produces (service, action, app) tuples from a line-based manifest.
+    """
+    for line in text.splitlines():
+        if not line.strip() or line.strip().startswith('#'):
+            continue
+
+        row = next(csv.reader([line], skipinitialspace=True))
+        if len(row) == 1:
+            # Whitespace-separated. The application is everything after the
+            # action, so paths containing spaces are kept intact.
+            row = line.split(None, 2)
+        row = [x.strip() for x in row]
+        yield tuple(row + [None] * (3 - len(row)))
+
+def validate(service, action, app=None, *extra):
+    """
+    Normalizes an operation and checks that it can be performed.
+    """
+    if extra:
+        raise ValueError("Too many values in manifest entry: {}".format((service, action, app) + extra))
+
+    service = str(service).lower() if service else service
+    action  = str(action).lower() if action else action
+    if service not in universal.available_services:
+        raise ValueError("Invalid service in manifest: {}".format(service))
+    if action not in universal.available_actions:
+        raise ValueError("Invalid action in manifest: {}".format(action))
+
+    return (service, action, app if app else None)
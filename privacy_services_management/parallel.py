@@ -0,0 +1,39 @@
+from multiprocessing.pool import ThreadPool
+
+# The number of workers used when none is specified. The work done per item is
+# mostly file and SQLite I/O, so a handful of threads is plenty.
+default_jobs = 8
+
+def fan_out(function, items, jobs=None):
+    """
+    Calls a function on each of the items using a bounded pool of worker
+    threads. An exception raised for one item does not stop the others.
+
+    :param function: a function taking a single item
+    :param items: an iterable of items to process
+    :param jobs: the maximum number of items processed at once
+    :return: a list of (item, result, error) tuples in the order the items were
+             given, where 'error' is the exception raised for that item (or None
+             if it succeeded)
+    """
+    items = list(items)
+    if not items:
+        return []
+    jobs = max(1, min(jobs or default_jobs, len(items)))
+
+    def call(item):
+        try:
+            return (item, function(item), None)
+        except Exception as e:
+            return (item, None, e)
+
+    # Don't bother with threads if there's nothing to run alongside.
+    if jobs == 1:
+        return [call(item) for item in items]
+
+    pool = ThreadPool(jobs)
+    try:
+        return pool.map(call, items)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,95 @@
+import json
+import threading
+
+# The external commands which a run may need.
+commands = ['launchctl', 'chown', 'codesign', 'ioreg']
+
+class Plan(object):
+    """
+    Collects what a run would do, without doing it. Editors given a plan open
+    the databases and property lists read-only and record here which entries
+    would change, which external commands would be run, and how many times
+    something would be committed.
+
+    A plan may be shared by editors running in different threads.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changes = []
+        self.commands = dict((name, 0) for name in commands)
+        self.commits = 0
+        self.created = []
+        self.reowned = 0
+
+    def change(self, target, key, change):
+        """
+        Records the effect on one entry.
+
+        :param target: the database or property list holding the entry
+        :param key: the entry, e.g. a service and client, or a plist key
+        :param change: 'add', 'update', 'remove', or 'unchanged'
+        """
+        with self.lock:
+            self.changes.append((target, key, change))
+
+    def command(self, name, count=1):
+        """
+        Records that an external command would be run.
+        """
+        with self.lock:
+            self.commands[name] = self.commands.get(name, 0) + count
+
+    def reown(self, count=1):
+        """
+        Records that files would be given back to their owner in-process,
+        without running `chown`.
+        """
+        with self.lock:
+            self.reowned += count
+
+    def commit(self, target):
+        """
+        Records that changes to a database or property list would be committed.
+        """
+        with self.lock:
+            self.commits += 1
+
+    def create(self, path):
+        """
+        Records that a database would be created.
+        """
+        with self.lock:
+            self.created.append(path)
+
+    def summary(self):
+        """
+        :return: a dictionary of how many entries would be changed in each way,
+                 how many times each command would be run, how many commits
+                 would be made, which databases would be created, and how many
+                 files would be re-owned in-process
+        """
+        with self.lock:
+            counts = dict((change, 0) for change in ['add', 'update', 'remove', 'unchanged'])
+            for target, key, change in self.changes:
+                counts[change] += 1
+            return {
+                'changes':  counts,
+                'commands': dict(self.commands),
+                'commits':  self.commits,
+                'created':  list(self.created),
+                'reowned':  self.reowned,
+            }
+
+    def report(self, logger):
+        """
+        Writes the plan to the log: one line for each entry which would change,
+        then the summary as a single line of JSON.
+
+        :param logger: a management_tools.loggers logger for recording output
+        """
+        for path in self.created:
+            logger.info("Would create '{}'.".format(path))
+        for target, key, change in self.changes:
+            if change != 'unchanged':
+                logger.info("Would {} '{}' in '{}'.".format(change, key, target))
+        logger.info("plan: " + json.dumps(self.summary(), sort_keys=True))
@@ -0,0 +1,14 @@
+# The TCC services have particular names and databases. This table is kept
+# apart from the editors so that it can be read without loading them.
+# The tuplet is (Service Name, TCC database, Darwin version introduced)
+available_services = {
+    'accessibility': ('kTCCServiceAccessibility', 'root',  13),
+    'contacts':      ('kTCCServiceAddressBook',   'local', 12),
+    'icloud':        ('kTCCServiceUbiquity',      'local', 13),
+    'calendar':      ('kTCCServiceCalendar',      'local', 13),
+    'reminders':     ('kTCCServiceReminders',     'local', 13)
+}
+
+# Where a TCC database is kept, relative to the root directory (for the global
+# database) or a user's home directory (for their own).
+tcc_database = 'Library/Application Support/com.apple.TCC/TCC.db'
@@ -0,0 +1,288 @@
+import json
+import manifest
+import os
+import sys
+import universal
+
+# The settings each service may be given in a desired state.
+settings = ['allow', 'deny', 'exclusive', 'enabled']
+
+# The types of the applications' names read from JSON.
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+def read(source):
+    """
+    Reads a desired state. A desired state is a JSON object giving, for each
+    service, the applications which should be allowed and denied:
+
+        {
+            "contacts": {"allow": ["com.apple.Safari"], "exclusive": true},
+            "location": {"enabled": true, "deny": ["com.apple.Maps"]}
+        }
+
+    If 'exclusive' is true, every other application is removed from the
+    service. For Location Services, 'enabled' turns the service on or off
+    globally.
+
+    :param source: a path to a state file, or '-' to read from stdin
+    :return: a dictionary mapping each service to a dictionary of its 'allow'
+             and 'deny' lists, 'exclusive' flag, and 'enabled' setting (None
+             if it's to be left alone)
+    """
+    if source == '-':
+        data = json.load(sys.stdin)
+    else:
+        with open(source) as f:
+            data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError("The desired state must be a JSON object of services.")
+
+    state = {}
+    for service, spec in data.items():
+        service = str(service).lower()
+        if service not in universal.available_services:
+            raise ValueError("Invalid service in desired state: {}".format(service))
+        if not isinstance(spec, dict):
+            raise ValueError("Invalid desired state for service '{}': {}".format(service, spec))
+        unknown = [key for key in spec if key not in settings]
+        if unknown:
+            raise ValueError("Unknown setting(s) for service '{}': {}".format(service, ', '.join(unknown)))
+        if 'enabled' in spec and service != 'location':
+            raise ValueError("Only service 'location' can be enabled or disabled globally.")
+
+        for key in ('allow', 'deny'):
+            value = spec.get(key)
+            if value is not None and (not isinstance(value, list) or not all(isinstance(app, string_types) for app in value)):
+                raise ValueError("Invalid '{}' for service '{}' (must be a list of applications): {}".format(key, service, value))
+        allow = list(spec.get('allow') or [])
+        deny  = list(spec.get('deny') or [])
+        both  = set(allow) & set(deny)
+        if both:
+            raise ValueError("Applications both allowed and denied in service '{}': {}".format(service, ', '.join(sorted(both))))
+        state[service] = {
+            'allow':     allow,
+            'deny':      deny,
+            'exclusive': bool(spec.get('exclusive')),
+            'enabled':   None if spec.get('enabled') is None else bool(spec['enabled']),
+        }
+    return state
+
+def required(services, apps):
+    """
+    Makes a desired state in which each of the applications is allowed in each
+    of the services. If no applications are given, Location Services should be
+    enabled globally.
+
+    :param services: a list of services
+    :param apps: a list of applications
+    :return: a desired state, as from `read`
+    """
+    state = {}
+    for service in services:
+        if not apps and service != 'location':
+            raise ValueError("No applications given for service '{}'.".format(service))
+        state[service] = {
+            'allow':     list(apps),
+            'deny':      [],
+            'exclusive': False,
+            'enabled':   None if apps else True,
+        }
+    return state
+
+def reconcile(state, logger, user='', template=False, lang='English', forceroot=False, no_check=False, no_check_type=None, full_repair=False, root_dir='/', version=None, plan=None):
+    """
+    Brings the services in line with a desired state. The current state is read
+    first, through read-only editors, and only the differences are written.
+    When nothing differs, nothing is opened for writing at all.
+
+    :param state: a desired state, as from `read`
+    :param logger: a management_tools.loggers logger for recording output
+    :param root_dir: the root of the system to modify (default '/')
+    :param version: the Darwin version of that system, if it isn't running
+    :param plan: a plan.Plan to record the changes in instead of making them
+    :return: whether anything had to be changed
+    """
+    def editor(service, read_only=False):
+        return universal.get_editor(
+            service         = service,
+            logger          = logger,
+            user            = user,
+            template        = template,
+            lang            = lang,
+            forceroot       = forceroot,
+            no_check        = no_check,
+            no_check_type   = no_check_type,
+            autocommit      = False,
+            full_repair     = full_repair,
+            root_dir        = root_dir,
+            version         = version,
+            plan            = plan if not read_only else None,
+            read_only       = read_only,
+        )
+
+    changed = False
+    tcc = [
+        (database, [service for service in sorted(state) if universal.get_database(service) == database])
+        for database in manifest.database_order
+        if database != 'location'
+    ]
+    tcc = [(database, services) for database, services in tcc if services]
+    if tcc:
+        # Find what differs in each service.
+        deltas = {}
+        with editor(tcc[0][1][0], read_only=True) as e:
+            for database, services in tcc:
+                for service in services:
+                    deltas[service] = _delta(e, service, state[service], e.grants(service))
+
+        databases = [
+            (database, services) for database, services in tcc
+            if any(any(deltas[service]) for service in services)
+        ]
+        if not databases:
+            logger.info("The TCC services already match the desired state.")
+        else:
+            changed = True
+            with editor(databases[0][1][0]) as e:
+                for database, services in databases:
+                    for service in services:
+                        inserts, disables, removes = deltas[service]
+                        if inserts:
+                            e.insert_many(inserts, service, resolved=True)
+                        if disables:
+                            e.disable_many(disables, service, resolved=True)
+                        if removes:
+                            e.remove_many(removes, service, resolved=True)
+                    e.commit(database)
+                    logger.info("Committed changes to the '{}' database.".format(database))
+
+    if 'location' in state:
+        spec = state['location']
+        probe = editor('location', read_only=True)
+        probe.reconcile(**spec)
+        if not probe.changed():
+            logger.info("Location Services already matches the desired state.")
+        else:
+            changed = True
+            with editor('location') as e:
+                e.reconcile(**spec)
+
+    return changed
+
+def check(state, logger, user='', template=False, lang='English', forceroot=False, no_check=False, no_check_type=None, root_dir='/', version=None):
+    """
+    Compares the services with a desired state, without changing anything.
+    The TCC databases are read through read-only connections, and the Location
+    Services property lists are parsed in-process; locationd is never stopped,
+    and nothing is written or re-owned. A database which doesn't exist is
+    treated as empty, and one which can't be read is a mismatch.
+
+    :param state: a desired state, as from `read`
+    :param logger: a management_tools.loggers logger for recording output
+    :param root_dir: the root of the system to check (default '/')
+    :param version: the Darwin version of that system, if it isn't running
+    :return: a list of (service, client, problem) tuples, which is empty if
+             the services match the desired state; the client is None for the
+             global Location Services setting, and for a service whose
+             database couldn't be read
+    """
+    mismatches = []
+
+    tcc = [service for service in sorted(state) if service != 'location']
+    if tcc:
+        import sqlite3
+        import tcc_services
+        with tcc_services.TCCEdit(
+            service         = tcc[0],
+            logger          = logger,
+            user            = user,
+            template        = template,
+            lang            = lang,
+            forceroot       = forceroot,
+            no_check        = no_check,
+            no_check_type   = no_check_type,
+            root_dir        = root_dir,
+            version         = version,
+            read_only       = True,
+        ) as e:
+            for service in tcc:
+                # A database which can't be read can't be shown to match.
+                try:
+                    current = e.grants(service)
+                except (ValueError, EnvironmentError, sqlite3.Error) as error:
+                    logger.error("Could not read service '{}': {}".format(service, error))
+                    mismatches.append((service, None, 'unreadable'))
+                    continue
+                inserts, disables, removes = _delta(e, service, state[service], current)
+                mismatches += [(service, client, 'missing' if client not in current else 'not allowed') for client, _ in inserts]
+                mismatches += [(service, client, 'allowed') for client, _ in disables]
+                mismatches += [(service, client, 'unexpected') for client, _ in removes]
+
+    if 'location' in state:
+        mismatches += _check_location(state['location'], no_check, root_dir)
+
+    return mismatches
+
+def _check_location(spec, no_check=False, root_dir='/'):
+    """
+    Compares Location Services with its desired state.
+
+    :return: a list of (service, client, problem) tuples
+    """
+    import clients_plist
+    import location_services
+
+    directory = os.path.join(root_dir, location_services.locationd_dir.lstrip('/'))
+    path = os.path.join(directory, 'clients.plist')
+    clients = clients_plist.read_plist(path) if os.path.isfile(path) else {}
+
+    mismatches = []
+    wanted = set()
+    for target in spec['allow']:
+        key = location_services.client_key(target, no_check)
+        wanted.add(key)
+        if key not in clients:
+            mismatches.append(('location', target, 'missing'))
+        elif not clients[key].get('Authorized'):
+            mismatches.append(('location', target, 'not allowed'))
+    for target in spec['deny']:
+        key = location_services.client_key(target, no_check)
+        wanted.add(key)
+        if clients.get(key, {}).get('Authorized'):
+            mismatches.append(('location', target, 'allowed'))
+    if spec['exclusive']:
+        mismatches += [('location', key, 'unexpected') for key in sorted(clients) if key not in wanted]
+
+    if spec['enabled'] is not None:
+        offline = os.path.abspath(root_dir) != '/'
+        current = clients_plist.read_plist(location_services.global_plist_path(directory, offline, read_only=True)).get('LocationServicesEnabled')
+        if bool(current) != spec['enabled']:
+            mismatches.append(('location', None, 'enabled' if current else 'disabled'))
+
+    return mismatches
+
+def _delta(editor, service, spec, current):
+    """
+    Compares a service's current clients with its desired state.
+
+    :param editor: a TCC editor
+    :param service: the service to compare
+    :param spec: the service's desired state
+    :param current: the service's current clients, as from the editor's
+                    `grants`
+    :return: a tuple of the lists of (client, client_type) tuples to insert,
+             to disable, and to remove
+    """
+    allow = editor.resolve(spec['allow'])
+    deny = editor.resolve(spec['deny'])
+
+    inserts = [(client, client_type) for client, client_type in allow if not current.get(client, (None, False))[1]]
+    disables = [(client, client_type) for client, client_type in deny if current.get(client, (None, False))[1]]
+    removes = []
+    if spec['exclusive']:
+        wanted = set(client for client, client_type in allow + deny)
+        removes = [(client, current[client][0]) for client in sorted(current) if client not in wanted]
+    return (inserts, disables, removes)
@@ -1,23 +1,227 @@
+import app_cache
 import os
+import random
+import shutil
 import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import timings
 import universal
 
-try:
-    from management_tools.app_info import AppInfo
-except ImportError as e:
-    print("You need version 1.6.0 or greater of the 'Management Tools' module to be installed first.")
-    print("https://github.com/univ-of-utah-marriott-library-apple/management_tools")
-    raise e
-
-# The services have particular names and databases.
-# The tuplet is (Service Name, TCC database, Darwin version introduced)
-available_services = {
-    'accessibility': ('kTCCServiceAccessibility', 'root',  13),
-    'contacts':      ('kTCCServiceAddressBook',   'local', 12),
-    'icloud':        ('kTCCServiceUbiquity',      'local', 13),
-    'calendar':      ('kTCCServiceCalendar',      'local', 13),
-    'reminders':     ('kTCCServiceReminders',     'local', 13)
-}
+from services import available_services, tcc_database
+
+# How long (in seconds) to wait for another process to release a database lock
+# before giving up on a transaction. The waiting is done here rather than by
+# SQLite, so that all of it is counted: a locked transaction is tried again
+# every `lock_poll` seconds.
+default_busy_timeout = 1.0
+lock_poll = 0.01
+
+# How many times a transaction is retried from the beginning after the database
+# was found to be locked, and the range of the randomized delay between tries.
+# The delay is chosen uniformly from zero up to a limit which doubles with each
+# attempt, so that concurrent writers don't all retry at the same moment.
+default_lock_retries = 5
+backoff_base = 0.05
+backoff_max  = 2.0
+
+
+class Schema(object):
+    """
+    Describes the layout of a TCC database's 'access' table, as read from the
+    database itself, and builds the statements used to write to it.
+
+    Prior to OS X 10.8 (Darwin 12) there was no TCC database.
+    In OS X 10.9 (Darwin 13) Apple added a 'csreq' field.
+    In OS X 10.11 (Darwin 15) Apple added a 'policy_id' field.
+    In macOS 11 (Darwin 20) Apple replaced 'allowed' and 'prompt_count' with
+    'auth_value', 'auth_reason', and 'auth_version', among other fields.
+    """
+    def __init__(self, version, columns):
+        """
+        :param version: the schema version from the database's 'admin' table
+        :param columns: the rows of `PRAGMA table_info(access)`
+        """
+        self.version = version
+        self.columns = [column[1] for column in columns]
+        self.statements = {}
+
+        # Columns which are left out of inserts entirely because they have a
+        # default value, and the values to use for the remaining columns which
+        # aren't otherwise set.
+        self.defaulted = set(column[1] for column in columns if column[4] is not None)
+        self.fillers = dict(
+            (column[1], 'NULL' if not column[3] else ("''" if 'TEXT' in column[2].upper() else '0'))
+            for column in columns
+        )
+
+    @classmethod
+    def read(cls, connection):
+        """
+        Reads the schema of the database at the other end of a connection.
+        """
+        try:
+            version = connection.execute("SELECT value FROM admin WHERE key = 'version'").fetchone()
+            version = version[0] if version else None
+        except sqlite3.OperationalError:
+            version = None
+        columns = connection.execute('PRAGMA table_info(access)').fetchall()
+        if not columns:
+            raise RuntimeError("Not a TCC database: no 'access' table.")
+        return cls(version, columns)
+
+    def replace(self, allowed, prompt_count):
+        """
+        :return: an 'INSERT or REPLACE' statement which takes the service,
+                 client, and client type as parameters
+        """
+        key = ('replace', allowed, prompt_count)
+        if key not in self.statements:
+            columns, values = self.__row(allowed, prompt_count)
+            self.statements[key] = 'INSERT or REPLACE into access ({}) values(?, ?, ?, {})'.format(
+                ', '.join(columns), ', '.join(values[3:])
+            )
+        return self.statements[key]
+
+    def replace_existing(self, allowed, prompt_count):
+        """
+        :return: an 'INSERT or REPLACE' statement which writes each target in
+                 'temp.targets' whose service and client are already present
+        """
+        key = ('replace_existing', allowed, prompt_count)
+        if key not in self.statements:
+            columns, values = self.__row(allowed, prompt_count)
+            self.statements[key] = (
+                'INSERT or REPLACE into access ({}) '
+                'SELECT t.service, t.client, t.client_type, {} '
+                'FROM temp.targets t '
+                'WHERE EXISTS (SELECT 1 FROM access a WHERE a.service IS t.service AND a.client IS t.client)'
+            ).format(', '.join(columns), ', '.join(values[3:]))
+        return self.statements[key]
+
+    def granted(self):
+        """
+        :return: an SQL expression which is true for rows granting access
+        """
+        if 'allowed' in self.columns:
+            return 'allowed'
+        return 'auth_value = 2'
+
+    def __row(self, allowed, prompt_count):
+        """
+        :return: a tuple of the columns written by an insert, and the SQL
+                 values for them
+        """
+        known = {
+            'service':      '?',
+            'client':       '?',
+            'client_type':  '?',
+            'allowed':      str(allowed),
+            'prompt_count': str(prompt_count),
+            'auth_value':   '2' if allowed else '0',
+            'auth_reason':  '4',
+            'auth_version': '1',
+        }
+        columns = ['service', 'client', 'client_type']
+        values  = ['?', '?', '?']
+        for column in self.columns:
+            if column in columns:
+                continue
+            if column in known:
+                value = known[column]
+            elif column in self.defaulted:
+                continue
+            else:
+                value = self.fillers[column]
+            columns.append(column)
+            values.append(value)
+        return (columns, values)
+
+class LockStats(object):
+    """
+    Counts how often, and for how long, writes had to wait for a database lock.
+    The counters may be shared by editors running in different threads.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.retries = 0
+        self.waited = 0.0
+
+    def record(self, waited, retried=False):
+        """
+        Records time spent waiting for a lock.
+
+        :param waited: the seconds spent waiting on the lock and backing off
+        :param retried: whether the transaction was given up on and retried
+                        after a randomized delay
+        """
+        with self.lock:
+            if retried:
+                self.retries += 1
+            self.waited += waited
+
+    def __str__(self):
+        return "{} retried transaction(s), {:.3f}s waiting on locks".format(self.retries, self.waited)
+
+# The lock waits of every editor in this process.
+lock_stats = LockStats()
+
+def is_locked(error):
+    """
+    :return: whether an SQLite error was caused by another connection holding
+             a lock on the database
+    """
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+def backoff(attempt):
+    """
+    :param attempt: the number of the retry about to be made, starting at 1
+    :return: how long to wait before retrying, in seconds
+    """
+    return random.uniform(0, min(backoff_max, backoff_base * 2 ** (attempt - 1)))
+
+def connect_read_only(path, timeout=None, immutable=False):
+    """
+    Opens a database without allowing any changes to it. Where the sqlite3
+    module supports URIs (Python 3), the file itself is opened read-only;
+    otherwise (Python 2) the connection is set to refuse writes, and still takes
+    shared locks while reading, waiting for up to the timeout.
+
+    :param path: the location of an existing database
+    :param timeout: how long to wait for locks (default `default_busy_timeout`)
+    :param immutable: whether to skip locking entirely (only under Python 3),
+                      so that reading never waits for or blocks a writer such
+                      as tccd; a write made while reading may then be missed
+    :return: a connection to the database
+    """
+    if timeout is None:
+        timeout = default_busy_timeout
+    if sys.version_info[0] >= 3:
+        from urllib.parse import quote
+        uri = 'file:{}?mode=ro{}'.format(quote(path), '&immutable=1' if immutable else '')
+        return sqlite3.connect(uri, timeout=timeout, uri=True)
+    connection = sqlite3.connect(path, timeout=timeout)
+    connection.execute('PRAGMA query_only = ON')
+    return connection
+
+# The schemas of the databases seen so far, by path: (inode, schema).
+_schemas = {}
+
+def get_schema(path, connection):
+    """
+    Finds the schema of the database at the given path. Each database is only
+    read once, unless it is replaced by a new file.
+
+    :param path: the location of the database
+    :param connection: a connection to the database
+    """
+    inode = os.stat(path).st_ino
+    if path not in _schemas or _schemas[path][0] != inode:
+        _schemas[path] = (inode, Schema.read(connection))
+    return _schemas[path][1]
 
 class TCCEdit(object):
     """
@@ -40,14 +244,64 @@ class TCCEdit(object):
         lang            = 'English',
         forceroot       = False,
         no_check        = False,
-        no_check_type   = None
+        no_check_type   = None,
+        autocommit      = True,
+        home            = None,
+        version         = None,
+        root_dir        = '/',
+        busy_timeout    = None,
+        retries         = None,
+        plan            = None,
+        read_only       = False,
+        golden          = None
     ):
         # Set the logger for output.
         self.logger = logger
 
+        # When autocommit is disabled, changes are held in a single transaction
+        # per database until `commit()` is called (or the 'with' block exits).
+        self.autocommit = autocommit
+
+        # If the database is locked by someone else (e.g. tccd, or another
+        # copy of this program), wait for it and then retry the transaction.
+        # The module's settings are used unless others are given.
+        self.busy_timeout = default_busy_timeout if busy_timeout is None else busy_timeout
+        self.retries = default_lock_retries if retries is None else retries
+        self.lock_stats = LockStats()
+
+        # If a plan is given, nothing is written. The databases are opened
+        # read-only, and the changes which would be made are recorded in the
+        # plan instead.
+        self.plan = plan
+        self.pending = set()
+
+        # A read-only editor (which every planning editor is) opens the
+        # databases read-only, and treats those which don't exist as empty.
+        self.read_only = read_only or plan is not None
+
+        # Nothing is modified or created by a read-only editor without a plan,
+        # so the refusals to do either don't apply to it.
+        self.checking = self.read_only and plan is None
+
+        # If a golden database is given (see the 'golden' module), a missing
+        # local database is copied from it instead of being built.
+        self.golden = golden
+
         # If a service is given, stick with that.
         self.service = service
 
+        # All of the databases are found relative to this directory. Anything
+        # other than '/' is a system which isn't running (e.g. a mounted disk
+        # image), so its global database may be modified without being root.
+        self.root_dir = root_dir
+        self.offline = os.path.abspath(root_dir) != '/'
+
+        # A home directory may be given directly instead of looking up the
+        # user's home. The user is then named after the home directory.
+        self.home = home
+        if home and not user:
+            user = os.path.basename(os.path.normpath(home))
+
         # If no user is specified, use the current user instead.
         if not user:
             import getpass
@@ -66,56 +320,53 @@ class TCCEdit(object):
             self.type = 'app'
 
         # Check the version of OS X before continuing; only Darwin versions 12
-        # and above support the TCC database system.
-        try:
-            version = int(os.uname()[2].split('.')[0])
-        except:
-            raise RuntimeError("Could not acquire the OS X version.")
+        # and above support the TCC database system. A version can be given to
+        # use instead of the running system's.
+        if version is None:
+            try:
+                version = int(os.uname()[2].split('.')[0])
+            except:
+                raise RuntimeError("Could not acquire the OS X version.")
+        version = int(version)
         if version < 12:
             raise RuntimeError("No TCC functionality on this version of OS X.")
         self.version = version
 
         # Establish database locations.
         local_log_entry = ''
+        self.template = template
+        self.refuse_local = False
         if template:
             # This script supports the use of the User Template provided by
             # Apple, but only root may modify anything therein.
-            if not os.geteuid() == 0:
+            if not os.geteuid() == 0 and not self.offline and not self.checking:
                 raise ValueError("Only root user may modify the User Template.")
-            self.local_path = ('/System/Library/User Template/{}.lproj/Library/Application Support/com.apple.TCC/TCC.db'.format(lang))
+            self.local_path = os.path.join(root_dir, 'System/Library/User Template/{}.lproj'.format(lang), tcc_database)
             
             # This is the beginning of the log entry. It'll be completed below.
             local_log_entry = ("Set to modify local permissions for the '{}' User Template at ".format(lang))
+        elif home:
+            self.local_path = os.path.join(home, tcc_database)
+            local_log_entry = ("Set to modify local permissions for user '{}' at ".format(self.user))
         else:
-            if self.user == 'root' and not forceroot:
-                if available_services[service][1] != 'root':
-                    # Prevent the root user from creating or modifying their own
-                    # local TCC database. This is to prevent confusion. The file
-                    # can be forced to be used by the `--forceroot` option.
-                    #
-                    # If the service being modified is root-level, don't bother
-                    # checking for the local TCC database file because it is
-                    # irrelevant.
-                    error = '''\
-Will not create a TCC database file for root.
-
-Creating a TCC database for the root user is generally not helpful, and
-there is really no good reason to do it.
-
-If you intended to change the permissions for a particular user as root,
-instead use the `--user` option. For example:
-
-    privacy_services_manager.py --user "username" add contacts com.apple.Safari
-
-If you really want to create a TCC database file for root, run the
-command with the `--forceroot` option:
-
-    privacy_services_manager.py --forceroot add contacts com.apple.Safari'''
-                    raise ValueError(error)
-                else:
-                    self.local_path = None
+            if self.user == 'root' and not forceroot and not self.checking:
+                # Prevent the root user from creating or modifying their own
+                # local TCC database. This is to prevent confusion. The file
+                # can be forced to be used by the `--forceroot` option.
+                #
+                # If only root-level services are modified, the local TCC
+                # database file is irrelevant, so the complaint waits until
+                # something actually needs it.
+                self.local_path = None
+                self.refuse_local = True
+            elif self.offline:
+                # The user's home can't be looked up on a system which isn't
+                # running, so it has to be in the usual place.
+                self.home = os.path.join(root_dir, 'Users', self.user)
+                self.local_path = os.path.join(self.home, tcc_database)
+                local_log_entry = ("Set to modify local permissions for user '{}' at ".format(self.user))
             else:
-                self.local_path = os.path.expanduser('~{}/Library/Application Support/com.apple.TCC/TCC.db'.format(self.user))
+                self.local_path = os.path.join(os.path.expanduser('~{}'.format(self.user)), tcc_database)
                 
                 # This is the beginning of the log entry. It'll be completed
                 # below.
@@ -127,38 +378,26 @@ command with the `--forceroot` option:
             # system. Maybe the user exists but isn't registered as a user?
             # Try looking in /Users/ just to see:
             if os.path.isdir('/Users/{}'.format(self.user)):
-                self.local_path = ('/Users/{}/Library/Application Support/com.apple.TCC/TCC.db'.format(self.user))
+                self.local_path = os.path.join('/Users', self.user, tcc_database)
             else:
                 raise ValueError("Invalid username supplied: {}".format(self.user))
 
         if self.local_path:
             self.logger.info(local_log_entry + "'" + self.local_path + "'.")
-        self.root_path = '/Library/Application Support/com.apple.TCC/TCC.db'
+        self.root_path = os.path.join(root_dir, tcc_database)
         self.logger.info("Set to modify global permissions for all users at '{}'.".format(self.root_path))
 
-        # Ensure the databases exist properly.
-        if os.geteuid() == 0 and not os.path.exists(self.root_path):
-            self.__create(self.root_path)
-        if self.local_path and not os.path.exists(self.local_path):
-            if (self.user == 'root' and forceroot) or self.user != 'root':
-                self.__create(self.local_path)
-
-        # Check there is write access to user's local TCC database.
-        if self.local_path and not os.access(self.local_path, os.W_OK):
-            if (self.user == 'root' and forceroot) or self.user != 'root':
-                raise ValueError("You do not have permission to modify {}'s TCC database.".format(self.user))
-
-        # Create the connections.
-        # Only root may modify the global TCC database.
-        if os.geteuid() == 0:
-            self.root = sqlite3.connect(self.root_path)
-        else:
-            self.root = None
-        if self.local_path:
-            self.local = sqlite3.connect(self.local_path)
-        else:
-            self.local = None
-        self.connections = {'root': self.root, 'local': self.local}
+        # The databases are only created and connected to when something in
+        # them is first modified, so a run which only needs one of them never
+        # touches the other. The schema of each database is read when it is
+        # connected to. The statements of each connection's transaction are
+        # kept until it is committed, so that it can be replayed if it has to
+        # be retried.
+        self.connections = {}
+        self.schemas = {}
+        self.journals = {}
+        self.paths = {}
+        self.inodes = {}
 
     def insert(self, target, service=None):
         """
@@ -167,184 +406,485 @@ command with the `--forceroot` option:
         :param target: an application or file to modify permissions for
         :param service: a service name to modify
         """
-        # Validate that they didn't pass us something nonexistent.
-        if target is None:
+        self.insert_many([target], service)
+
+    def insert_many(self, targets, service=None, resolved=False):
+        """
+        Enable each of the specified targets for the given service. All of the
+        targets are written with a single statement.
+
+        :param targets: an iterable of applications or files to modify
+                        permissions for
+        :param service: a service name to modify
+        :param resolved: whether the targets are already (client, client_type)
+                         tuples, as from `resolve`
+        """
+        clients = list(targets) if resolved else self.__resolve(targets)
+        if not clients:
             return
-        
-        # If not using admin override mode, look up a bundle identifier.
-        if self.no_check:
-            # We get the client type from the no_check_type.
-            if self.type == 'bin':
-                client_type = 1
-            elif self.type == 'app':
-                client_type = 0
-            else:
-                raise ValueError("Using no-check administrative override without a specified no-check type.")
-        else:
-            target = AppInfo(target).bid
-            client_type = 0
-        
-        # If the service was not specified, get the original.
-        if service is None and self.service:
-            service = self.service
-        else:
+        if self.plan:
+            self.__plan('insert', service, clients)
+            return
+        service, connection, schema = self.__prepare(service, check_version=True)
+        if not service:
             return
 
-        # Don't beat up the user for doing something like "AcCeSsIbILITy".
-        service = service.lower()
+        for client, client_type in clients:
+            self.logger.info("Inserting '{}' in service '{}'...".format(client, service))
 
-        # Check that the service is known to the program; I do not intend to
-        # support unsupported services here.
-        if not service in available_services.keys():
-            raise ValueError("Invalid service provided: {}".format(service))
+        # Add the entries!
+        values = [(available_services[service][0], client, client_type) for client, client_type in clients]
+        self.__write(connection, [(schema.replace(allowed=1, prompt_count=0), values)])
 
-        # Version checking for the current service.
-        if self.version < available_services[service][2]:
-            raise RuntimeError("Service '{}' does not exist on this version of OS X.".format(service))
+        self.logger.info("Inserted successfully.")
 
-        # Proceed.
-        self.logger.info("Inserting '{}' in service '{}'...".format(target, service))
+    def remove(self, target, service=None):
+        """
+        Remove an item from Privacy Services for the given service.
 
-        # Establish a connection with the TCC database.
-        connection = self.connections[available_services[service][1]]
+        :param target: an application or file to modify permissions for
+        :param service: a particular service to modify the permissions within
+        """
+        self.remove_many([target], service)
 
-        # Clearly you tried to modify something you weren't supposed to!
-        # For shame.
-        if not connection:
-            if os.geteuid() != 0:
-                raise ValueError("Must be root to modify '{}'".format(service))
-            else:
-                raise ValueError("Unable to connect to '{}'".format(service))
+    def remove_many(self, targets, service=None, resolved=False):
+        """
+        Remove each of the specified items from Privacy Services for the given
+        service. All of the targets are deleted with a single statement.
 
-        c = connection.cursor()
+        :param targets: an iterable of applications or files to modify
+                        permissions for
+        :param service: a particular service to modify the permissions within
+        :param resolved: whether the targets are already (client, client_type)
+                         tuples, as from `resolve`
+        """
+        clients = list(targets) if resolved else self.__resolve(targets)
+        if not clients:
+            return
+        if self.plan:
+            self.__plan('remove', service, clients)
+            return
+        service, connection, schema = self.__prepare(service)
+        if not service:
+            return
 
-        # Add the entry!
-        # Prior to OS X 10.8 (Darwin 12) there was no TCC database.
-        # In OS X 10.9 (Darwin 13) Apple added a 'csreq' field.
-        # In OS X 10.11 (Darwin 15) Apple added a 'policy_id' field.
-        values = (available_services[service][0], target, client_type)
-        if self.version == 12:
-            c.execute('INSERT or REPLACE into access values(?, ?, ?, 1, 0)', values)
-        elif 15 > self.version > 12:
-            c.execute('INSERT or REPLACE into access values(?, ?, ?, 1, 0, NULL)', values)
-        elif self.version >= 15:
-            c.execute('INSERT or REPLACE into access values(?, ?, ?, 1, 0, NULL, NULL)', values)
-        connection.commit()
+        for client, client_type in clients:
+            self.logger.info("Removing '{}' from service '{}'...".format(client, service))
 
-        self.logger.info("Inserted successfully.")
+        # Perform the deletion.
+        values = [(available_services[service][0], client) for client, client_type in clients]
+        self.__write(connection, [('DELETE FROM access WHERE service IS ? AND client IS ?', values)])
 
-    def remove(self, target, service=None):
+        self.logger.info("Removed successfully.")
+
+    def disable(self, target, service=None):
         """
-        Remove an item from Privacy Services for the given service.
+        Mark the application or file as being disallowed from utilizing Privacy
+        Services. If the target is not already in the database, it is left
+        alone.
 
         :param target: an application or file to modify permissions for
-        :param service: a particular service to modify the permissions within
+        :param service: the service to modify
+        """
+        self.disable_many([target], service)
+
+    def disable_many(self, targets, service=None, resolved=False):
+        """
+        Mark each of the applications or files as being disallowed from
+        utilizing Privacy Services. Targets which are not already in the
+        database are left alone.
+
+        :param targets: an iterable of applications or files to modify
+                        permissions for
+        :param service: the service to modify
+        :param resolved: whether the targets are already (client, client_type)
+                         tuples, as from `resolve`
         """
-        # Validate that they didn't pass us something nonexistent.
-        if target is None:
+        clients = list(targets) if resolved else self.__resolve(targets)
+        if not clients:
             return
-        
-        # If not using admin override mode, look up a bundle identifier.
-        if not self.no_check:
-            target = AppInfo(target).bid
-        
-        # If the service was not specified, get the original.
-        if service is None and self.service:
-            service = self.service
-        else:
+        if self.plan:
+            self.__plan('disable', service, clients)
+            return
+        service, connection, schema = self.__prepare(service)
+        if not service:
             return
 
-        # Be nice to the user.
-        service = service.lower()
+        for client, client_type in clients:
+            self.logger.info("Disabling '{}' in service '{}'...".format(client, service))
 
-        # Check the service is recognized.
-        if not service in available_services.keys():
-            raise ValueError("Invalid service provided: " + service)
+        # Load the targets into a temporary table, then disable those which
+        # are already present with a single statement. The 'prompt_count' must
+        # be 1 or else the system will ask the user anyway. This is the only
+        # time it seems to really matter.
+        values = [(available_services[service][0], client, client_type) for client, client_type in clients]
+        self.__write(connection, [
+            ('INSERT INTO temp.targets VALUES (?, ?, ?)', values),
+            (schema.replace_existing(allowed=0, prompt_count=1), None),
+            ('DELETE FROM temp.targets', None),
+        ])
 
-        self.logger.info("Removing '{}' from service '{}'...".format(target, service))
+        self.logger.info("Disabled successfully.")
 
-        # Establish a connection with the TCC database.
-        connection = self.connections[available_services[service][1]]
+    def grants(self, service=None):
+        """
+        Reads every client currently in a service, with a single query.
 
-        # Validate that the connection was successful.
+        :param service: the service to read
+        :return: a dictionary mapping each client to a tuple of its client type
+                 and whether it's allowed
+        """
+        service, connection, schema = self.__prepare(service)
         if not connection:
-            raise ValueError("Must be root to modify this service!")
+            return {}
+        rows = connection.execute(
+            'SELECT client, client_type, {} FROM access WHERE service IS ?'.format(schema.granted()),
+            (available_services[service][0],)
+        )
+        return dict((client, (client_type, bool(granted))) for client, client_type, granted in rows)
 
-        c = connection.cursor()
+    def resolve(self, targets):
+        """
+        Looks up the client identifier and client type of each target.
 
-        # Perform the deletion.
-        values = (available_services[service][0], target)
-        c.execute('DELETE FROM access WHERE service IS ? AND client IS ?', values)
-        connection.commit()
+        :param targets: an iterable of applications or files
+        :return: a list of (client, client_type) tuples, without duplicates
+        """
+        return self.__resolve(targets)
 
-        self.logger.info("Removed successfully.")
+    def provision(self):
+        """
+        Creates the local database from the golden database, if it doesn't
+        exist yet. The golden database already holds the policy, so nothing
+        more needs to be done to a database created this way.
 
-    def disable(self, target, service=None):
+        :return: whether the database was created
         """
-        Mark the application or file as being disallowed from utilizing Privacy
-        Services. If the target is not already in the database, it will be added
-        and then disabled.
+        if not self.golden or self.read_only or not self.local_path or os.path.exists(self.local_path):
+            return False
+        self.__connection('local', self.service)
+        return True
 
-        :param target: an application or file to modify permissions for
-        :param service: the service to modify
+    def __plan(self, action, service, clients):
         """
-        # Validate that they didn't pass us something nonexistent.
-        if target is None:
+        Records in the plan what an action would do to each of the clients,
+        without doing it.
+
+        :param action: 'insert', 'remove', or 'disable'
+        :param service: a service name, or None to use the editor's service
+        :param clients: a list of (client, client_type) tuples
+        """
+        service, connection, schema = self.__prepare(service, check_version=(action == 'insert'))
+        if not service:
             return
-        
-        # If not using admin override mode, look up a bundle identifier.
-        if self.no_check:
-            # We get the client type from the no_check_type.
-            if self.type == 'bin':
-                client_type = 1
-            elif self.type == 'app':
-                client_type = 0
+        database = available_services[service][1]
+        path = self.root_path if database == 'root' else self.local_path
+
+        for client, client_type in clients:
+            # Find whether the client is present, and if so whether it's
+            # allowed. A database which doesn't exist yet is empty.
+            row = None
+            if connection:
+                row = connection.execute(
+                    'SELECT {} FROM access WHERE service IS ? AND client IS ?'.format(schema.granted()),
+                    (available_services[service][0], client)
+                ).fetchone()
+
+            if action == 'insert':
+                change = 'add' if row is None else ('unchanged' if row[0] else 'update')
+            elif action == 'disable':
+                change = 'update' if row is not None and row[0] else 'unchanged'
             else:
-                raise ValueError("Using no-check administrative override without a specified no-check type.")
+                change = 'remove' if row is not None else 'unchanged'
+            self.plan.change(path, '{} {}'.format(service, client), change)
+
+        # The real run writes (and commits) even if nothing changes.
+        if self.autocommit:
+            self.plan.commit(path)
         else:
-            target = AppInfo(target).bid
-            client_type = 0
-        
+            self.pending.add(database)
+
+    def __resolve(self, targets):
+        """
+        Looks up the client identifier and client type of each target. Targets
+        which resolve to the same client are only included once.
+
+        :param targets: an iterable of applications or files
+        :return: a list of (client, client_type) tuples
+        """
+        clients = []
+        seen = set()
+        for target in targets:
+            # Validate that they didn't pass us something nonexistent.
+            if target is None:
+                continue
+
+            # If not using admin override mode, look up a bundle identifier.
+            if self.no_check:
+                # We get the client type from the no_check_type.
+                if self.type == 'bin':
+                    client_type = 1
+                elif self.type == 'app':
+                    client_type = 0
+                else:
+                    raise ValueError("Using no-check administrative override without a specified no-check type.")
+            else:
+                target = app_cache.lookup(target).bid
+                client_type = 0
+
+            if target not in seen:
+                seen.add(target)
+                clients.append((target, client_type))
+        return clients
+
+    def __prepare(self, service, check_version=False):
+        """
+        Validates the service and finds the connection to the database which
+        holds it.
+
+        :param service: a service name, or None to use the editor's service
+        :param check_version: whether to check that the service exists on this
+                              version of OS X
+        :return: a tuple of (service, connection, schema); the service is None
+                 if there is nothing to modify
+        """
         # If the service was not specified, get the original.
-        if service is None and self.service:
+        if service is None:
             service = self.service
-        else:
-            return
+        if not service:
+            return (None, None, None)
 
-        # Be nice to the user.
+        # Don't beat up the user for doing something like "AcCeSsIbILITy".
         service = service.lower()
 
-        # Check the service is recognized.
+        # Check that the service is known to the program; I do not intend to
+        # support unsupported services here.
         if not service in available_services.keys():
             raise ValueError("Invalid service provided: {}".format(service))
 
-        self.logger.info("Disabling '{}' in service '{}'...".format(target, service))
+        # Version checking for the current service.
+        if check_version and self.version < available_services[service][2]:
+            raise RuntimeError("Service '{}' does not exist on this version of OS X.".format(service))
 
         # Establish a connection with the TCC database.
-        connection = self.connections[available_services[service][1]]
+        connection = self.__connection(available_services[service][1], service)
+        return (service, connection, self.schemas.get(connection))
 
-        # Validate that the connection was successful.
-        if not connection:
-            raise ValueError("Must be root to modify this service!")
+    def __connection(self, database, service):
+        """
+        Finds the connection to one of the TCC databases. The first time a
+        database is needed, it is created (if necessary) and connected to.
 
-        c = connection.cursor()
+        :param database: 'root' or 'local'
+        :param service: the service which is being modified
+        :return: a connection to the database
+        """
+        if database in self.connections:
+            return self.connections[database]
 
-        # Disable the application for the given service.
-        # The 'prompt_count' must be 1 or else the system will ask the user
-        # anyway. This is the only time it seems to really matter.
-        values = (available_services[service][0], target, client_type)
-        c.execute('SELECT count(*) FROM access WHERE service IS ? and client IS ?', values[0:2])
-        count = c.fetchone()[0]
-        if count:
-            if self.version == 12:
-                c.execute('INSERT or REPLACE into access values(?, ?, ?, 0, 1)', values)
-            elif 15 > self.version > 12:
-                c.execute('INSERT or REPLACE into access values(?, ?, ?, 0, 1, NULL)', values)
-            elif self.version >= 15:
-                c.execute('INSERT or REPLACE into access values(?, ?, ?, 0, 1, NULL, NULL)', values)
-        connection.commit()
+        if database == 'root':
+            # Clearly you tried to modify something you weren't supposed to!
+            # For shame. Only root may modify the global TCC database.
+            if not (os.geteuid() == 0 or self.offline or self.checking):
+                raise ValueError("Must be root to modify '{}'".format(service))
+            path = self.root_path
+        else:
+            if self.refuse_local:
+                error = '''\
+Will not create a TCC database file for root.
 
-        self.logger.info("Disabled successfully.")
+Creating a TCC database for the root user is generally not helpful, and
+there is really no good reason to do it.
+
+If you intended to change the permissions for a particular user as root,
+instead use the `--user` option. For example:
+
+    privacy_services_manager.py --user "username" add contacts com.apple.Safari
+
+If you really want to create a TCC database file for root, run the
+command with the `--forceroot` option:
+
+    privacy_services_manager.py --forceroot add contacts com.apple.Safari'''
+                raise ValueError(error)
+            path = self.local_path
+
+        # Ensure the database exists properly. When reading only, a database
+        # which doesn't exist is left alone (and treated as being empty).
+        if not os.path.exists(path):
+            if self.read_only:
+                if self.plan:
+                    self.plan.create(path)
+                self.connections[database] = None
+                return None
+            with timings.measure('create_database', path):
+                self.__create(path)
+
+        # Check there is write access to user's local TCC database.
+        if database == 'local' and not self.read_only and not os.access(path, os.W_OK):
+            raise ValueError("You do not have permission to modify {}'s TCC database.".format(self.user))
+        if self.read_only and not os.access(path, os.R_OK):
+            raise ValueError("You do not have permission to read '{}'.".format(path))
+
+        self.connections[database] = self.__connect(path)
+        return self.connections[database]
+
+    def current(self):
+        """
+        :return: whether each of the open databases is still the file which was
+                 opened, i.e. it hasn't been replaced or removed since
+        """
+        try:
+            return all(os.stat(path).st_ino == self.inodes[connection] for connection, path in self.paths.items())
+        except OSError:
+            return False
+
+    def __connect(self, path):
+        """
+        Opens a connection to a TCC database and prepares the temporary table
+        used for set-based updates. (The table is created before any changes
+        are made, since creating it would otherwise commit them early.)
+
+        :param path: the location of the database
+        """
+        if self.read_only:
+            connection = connect_read_only(path, self.busy_timeout)
+            self.schemas[connection] = get_schema(path, connection)
+            return connection
+
+        # SQLite doesn't wait for locks itself; see `__retry`.
+        connection = sqlite3.connect(path, timeout=0)
+        self.journals[connection] = []
+        self.paths[connection] = path
+        self.inodes[connection] = os.stat(path).st_ino
+        self.__write(connection, [('CREATE TEMP TABLE targets (service TEXT, client TEXT, client_type INTEGER)', None)], commit=True)
+        self.schemas[connection] = self.__retry(connection, lambda tries: get_schema(path, connection))
+        return connection
+
+    def commit(self, database=None):
+        """
+        Commits any pending changes. This is only necessary when the editor was
+        created with `autocommit` disabled.
+
+        :param database: 'root' or 'local' to commit only that database
+        """
+        if self.plan:
+            for name in sorted(self.pending):
+                if database is None or database == name:
+                    self.plan.commit(self.root_path if name == 'root' else self.local_path)
+                    self.pending.discard(name)
+            return
+        if self.read_only:
+            return
+
+        for name, connection in self.connections.items():
+            if connection and (database is None or database == name):
+                self.__transact(connection, [], commit=True)
+
+    def rollback(self, database=None):
+        """
+        Discards any pending changes. This is only useful when the editor was
+        created with `autocommit` disabled.
+
+        :param database: 'root' or 'local' to roll back only that database
+        """
+        if self.read_only:
+            self.pending.clear()
+            return
+
+        for name, connection in self.connections.items():
+            if connection and (database is None or database == name):
+                connection.rollback()
+                del self.journals[connection][:]
+
+    def __write(self, connection, operations, commit=None):
+        """
+        Adds statements to the connection's current transaction, and commits it
+        unless autocommit is disabled.
+
+        :param connection: a connection to a TCC database
+        :param operations: a list of (statement, values) tuples; if 'values' is
+                           a list, the statement is executed once for each of
+                           its items
+        :param commit: whether to commit, if not the editor's autocommit setting
+        """
+        self.journals[connection].extend(operations)
+        self.__transact(connection, operations, commit=self.autocommit if commit is None else commit)
+
+    def __transact(self, connection, operations, commit):
+        """
+        Executes statements in the connection's transaction. If the database is
+        locked, the transaction is rolled back and replayed from the beginning
+        (see `__retry`).
+
+        :param connection: a connection to a TCC database
+        :param operations: a list of (statement, values) tuples to execute
+        :param commit: whether to commit the transaction afterwards
+        """
+        def attempt(tries):
+            # After a failed try, everything in the transaction was lost, so
+            # start it again.
+            c = connection.cursor()
+            with timings.measure('sqlite_execute', self.paths[connection]):
+                for statement, values in (list(self.journals[connection]) if tries else operations):
+                    if values is None:
+                        c.execute(statement)
+                    else:
+                        c.executemany(statement, values)
+            if commit:
+                with timings.measure('sqlite_commit', self.paths[connection]):
+                    connection.commit()
+                del self.journals[connection][:]
+
+        self.__retry(connection, attempt)
+
+    def __retry(self, connection, work):
+        """
+        Does some work on a connection, waiting for the database if it's
+        locked. The work is tried again every `lock_poll` seconds for up to the
+        editor's busy timeout; after that, it's retried after a randomized delay
+        (and the busy timeout starts over), up to the editor's number of
+        retries. All of the time spent waiting is counted in the lock stats.
+
+        :param connection: the connection the work uses; it's rolled back after
+                           each failed try
+        :param work: a function doing the work, given the number of failed
+                     tries so far
+        :return: what the work returns
+        """
+        tries = 0
+        attempt = 0
+        locked = None
+        while True:
+            start = time.time()
+            try:
+                return work(tries)
+            except sqlite3.OperationalError as e:
+                if not is_locked(e):
+                    raise
+                connection.rollback()
+                tries += 1
+                if locked is None:
+                    locked = start
+
+                retried = False
+                give_up = False
+                if time.time() - locked < self.busy_timeout:
+                    time.sleep(lock_poll)
+                elif attempt < self.retries:
+                    attempt += 1
+                    delay = backoff(attempt)
+                    self.logger.warn("Database is locked; retrying in {:.2f}s (attempt {} of {}).".format(delay, attempt, self.retries))
+                    time.sleep(delay)
+                    retried = True
+                    locked = None
+                else:
+                    give_up = True
+
+                waited = time.time() - start
+                self.lock_stats.record(waited, retried)
+                lock_stats.record(waited, retried)
+                if give_up:
+                    raise
 
     def __create(self, path):
         """
@@ -354,10 +894,23 @@ command with the `--forceroot` option:
         
         :param path: where to build the database
         """
-        # We need the user's ID and group ID to re-own the directory.
-        from pwd import getpwnam
-        uid = getpwnam(self.user).pw_uid
-        gid = getpwnam(self.user).pw_gid
+        # A user's database belongs to them. The User Template's doesn't belong
+        # to anyone in particular, and neither does a database on a system
+        # which isn't running unless the user's home is there (since the
+        # user's ID on this system means nothing there).
+        owned = self.user != 'root' and path == self.local_path and not self.template
+        if owned and self.offline and not (self.home and os.path.isdir(self.home)):
+            owned = False
+
+        # We need the user's ID and group ID to re-own the directory. If the
+        # home directory was given, it already has the right owner.
+        if owned and self.home:
+            uid = os.stat(self.home).st_uid
+            gid = os.stat(self.home).st_gid
+        elif owned:
+            from pwd import getpwnam
+            uid = getpwnam(self.user).pw_uid
+            gid = getpwnam(self.user).pw_gid
 
         self.logger.info("TCC.db file was expected at '{}' but was not found. Creating new TCC.db file...".format(path))
 
@@ -370,7 +923,7 @@ command with the `--forceroot` option:
             app_support_dir = os.path.dirname(database_dir)
             # Let's only bother with user permissions if this isn't a folder
             # owned by root.
-            if self.user != 'root' and path == self.local_path:
+            if owned:
                 # We'll have to modify the permissions on 'TCC.db' later.
                 chown_database = True
                 # Check existence of
@@ -390,10 +943,47 @@ command with the `--forceroot` option:
                     os.mkdir(database_dir, int('700', 8))
                     os.chown(database_dir, uid, gid)
             else:
+                # A user's home isn't made up, even if it can't be re-owned.
+                library_dir = os.path.dirname(app_support_dir)
+                if path == self.local_path and not self.template and self.user != 'root' and not os.path.isdir(library_dir):
+                    raise RuntimeError("No 'Library' directory found for database: {}".format(path))
                 # We're not dealing with a specific user's directory, so just
                 # make the parent directories as needed and ignore permissions.
-                os.makedirs(os.path.dirname(path), int('700', 8))
+                if not os.path.isdir(database_dir):
+                    os.makedirs(database_dir, int('700', 8))
+
+        if self.golden and path == self.local_path:
+            # Copy the golden database into a new file which no one else could
+            # have put (or linked) there, give it to the user, and then move it
+            # into place so that no one sees half of it. Nothing is done by
+            # path in the user's directory until the rename.
+            descriptor, temp = tempfile.mkstemp(prefix='TCC.db.', suffix='.tmp', dir=os.path.dirname(path))
+            try:
+                with os.fdopen(descriptor, 'wb') as f:
+                    with open(self.golden, 'rb') as golden:
+                        shutil.copyfileobj(golden, f)
+                    if chown_database:
+                        os.fchown(f.fileno(), uid, gid)
+                os.rename(temp, path)
+            except:
+                os.remove(temp)
+                raise
+            chown_database = False
+            self.logger.info("TCC.db file copied from golden database '{}'.".format(self.golden))
+        else:
+            self.__build(path)
+            self.logger.info("TCC.db file created successfully.")
+        
+        # The local database was created, so make sure permissions are set.
+        if chown_database:
+            os.chown(self.local_path, uid, gid)
 
+    def __build(self, path):
+        """
+        Builds the tables of a new TCC database.
+
+        :param path: where to build the database
+        """
         # Form an SQL connection with the file.
         connection = sqlite3.connect(path)
         c = connection.cursor()
@@ -467,12 +1057,6 @@ command with the `--forceroot` option:
         connection.commit()
         connection.close()
 
-        self.logger.info("TCC.db file created successfully.")
-        
-        # The local database was created, so make sure permissions are set.
-        if chown_database:
-            os.chown(self.local_path, uid, gid)
-
     def __enter__(self):
         """
         Allows for the TCCEdit object to be used in a 'with' clause.
@@ -483,9 +1067,34 @@ command with the `--forceroot` option:
         """
         Allows for the TCCEdit object to be used in a 'with' clause.
         
-        Properly closes all connections when the item is trashed.
+        Properly closes all connections when the item is trashed. Any changes
+        still pending are committed, unless an exception was raised, in which
+        case they are rolled back.
+        """
+        try:
+            if self.plan:
+                if type is None:
+                    self.commit()
+            elif not self.read_only:
+                for connection in self.connections.values():
+                    if connection:
+                        if type is None:
+                            self.__transact(connection, [], commit=True)
+                        else:
+                            connection.rollback()
+        finally:
+            self.__close()
+        # A plan or a read-only editor leaves everything on disk alone,
+        # including the caches.
+        if not self.read_only:
+            app_cache.save()
+        if self.lock_stats.waited:
+            self.logger.info("Waited for database locks: {}.".format(self.lock_stats))
+
+    def __close(self):
+        """
+        Closes the connections to the databases.
         """
-        if self.root:
-            self.root.close()
-        if self.local:
-            self.local.close()
+        for connection in self.connections.values():
+            if connection:
+                connection.close()
@@ -0,0 +1,69 @@
+import os
+import manifest
+import universal
+
+# Where Apple keeps the User Templates, relative to the root directory. There
+# is one template for each localization, e.g. 'English.lproj'.
+templates_dir = 'System/Library/User Template'
+
+def languages(root_dir='/'):
+    """
+    Finds the localizations of the User Template.
+
+    :param root_dir: the root of the system (default '/')
+    :return: a sorted list of languages, e.g. ['Dutch', 'English', ...]
+    """
+    directory = os.path.join(root_dir, templates_dir)
+    return sorted(
+        name[:-len('.lproj')]
+        for name in os.listdir(directory)
+        if name.endswith('.lproj') and os.path.isdir(os.path.join(directory, name))
+    )
+
+def apply_all_languages(entries, logger, jobs=None, no_check=False, no_check_type=None, root_dir='/', version=None, plan=None):
+    """
+    Applies the same operations to every localization of the User Template.
+    Each template's database is modified by its own editor in a single
+    transaction (and created if it doesn't exist yet), and the templates are
+    processed concurrently by a bounded pool of workers.
+
+    :param entries: a list of (service, action, app) tuples, for services
+                    stored in the local databases
+    :param logger: a management_tools.loggers logger for recording output
+    :param jobs: the maximum number of templates modified at once
+    :param root_dir: the root of the system (default '/')
+    :param version: the Darwin version of that system, if it isn't running
+    :param plan: a plan.Plan to record the changes in instead of making them
+    :return: a list of (language, error) tuples, where 'error' is None if the
+             template was modified successfully
+    """
+    for service, action, app in entries:
+        if universal.get_database(service) != 'local':
+            raise ValueError("Service '{}' is not stored in the User Template.".format(service))
+
+    import parallel
+
+    def modify(lang):
+        manifest.apply(
+            entries         = entries,
+            logger          = logger,
+            template        = True,
+            lang            = lang,
+            no_check        = no_check,
+            no_check_type   = no_check_type,
+            root_dir        = root_dir,
+            version         = version,
+            plan            = plan,
+        )
+
+    langs = languages(root_dir)
+    logger.info("Modifying {} User Template localization(s)...".format(len(langs)))
+
+    results = []
+    for lang, _, error in parallel.fan_out(modify, langs, jobs):
+        if error:
+            logger.error("Failed for the '{}' User Template: {}".format(lang, error))
+        else:
+            logger.info("Modified the '{}' User Template successfully.".format(lang))
+        results.append((lang, error))
+    return results
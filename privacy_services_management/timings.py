@@ -0,0 +1,104 @@
+import json
+import threading
+import time
+
+# Whether anything is being recorded. While this is False, `measure()` hands
+# back a shared object which does nothing, so the instrumented code pays only
+# for a function call.
+enabled = False
+
+_lock = threading.Lock()
+_started = None
+_phases = {}
+
+class _Measurement(object):
+    """
+    Times the code in a 'with' block and records it under a phase and subject.
+    """
+    def __init__(self, phase, subject):
+        self.phase = phase
+        self.subject = subject
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        record(self.phase, self.subject, time.time() - self.start)
+
+class _NullMeasurement(object):
+    """
+    Stands in for a measurement when timings are disabled.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+_null = _NullMeasurement()
+
+def enable():
+    """
+    Starts recording timings, discarding anything recorded before.
+    """
+    global enabled, _started
+    with _lock:
+        _phases.clear()
+        _started = time.time()
+        enabled = True
+
+def measure(phase, subject=None):
+    """
+    Times a phase of the work, e.g.:
+
+        with timings.measure('codesign', path):
+            ...
+
+    :param phase: the name of the phase
+    :param subject: what the phase was working on, such as an application or a
+                    database
+    :return: a context manager
+    """
+    if not enabled:
+        return _null
+    return _Measurement(phase, subject)
+
+def record(phase, subject, seconds):
+    """
+    Records time spent in a phase.
+    """
+    with _lock:
+        entry = _phases.setdefault(phase, {'count': 0, 'seconds': 0.0, 'subjects': {}})
+        entry['count'] += 1
+        entry['seconds'] += seconds
+        if subject is not None:
+            subject = str(subject)
+            entry['subjects'][subject] = entry['subjects'].get(subject, 0.0) + seconds
+
+def summary():
+    """
+    :return: a dictionary of the total time since timings were enabled and,
+             for each phase, how many times it ran and how long it took in
+             total and for each subject
+    """
+    with _lock:
+        return {
+            'total': round(time.time() - _started, 6) if _started else None,
+            'phases': dict(
+                (phase, {
+                    'count':    entry['count'],
+                    'seconds':  round(entry['seconds'], 6),
+                    'subjects': dict((subject, round(seconds, 6)) for subject, seconds in entry['subjects'].items()),
+                })
+                for phase, entry in _phases.items()
+            ),
+        }
+
+def report(logger):
+    """
+    Writes the summary to the log as a single line of JSON.
+
+    :param logger: a management_tools.loggers logger for recording output
+    """
+    logger.info("timings: " + json.dumps(summary(), sort_keys=True))
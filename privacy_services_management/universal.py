@@ -1,5 +1,4 @@
-import location_services
-import tcc_services
+import services
 
 # Common attributes of the module and script.
 attributes = {
@@ -10,21 +9,55 @@ attributes = {
 
 # This is a list of services which can be modified.
 # Useful for scripts to call on for a neat list.
-available_services = tcc_services.available_services.keys() + ['location']
+available_services = services.available_services.keys() + ['location']
 
-def get_editor(service, logger, user='', template=False, lang='English', forceroot=False, no_check=False, no_check_type=None):
+# These are the actions which can be performed on a service, along with the
+# name of the editor method that carries each one out.
+available_actions = ['add', 'remove', 'enable', 'disable']
+action_methods = {
+    'add':     'insert',
+    'enable':  'insert',
+    'remove':  'remove',
+    'disable': 'disable',
+}
+
+def get_database(service):
+    """
+    Returns the name of the database which holds the given service's
+    permissions: 'root' or 'local' for the TCC services, or 'location' for
+    Location Services.
+    """
+    if service in services.available_services.keys():
+        return services.available_services[service][1]
+    elif service == 'location':
+        return 'location'
+    else:
+        raise ValueError("Invalid service: " + str(service))
+
+def get_editor(service, logger, user='', template=False, lang='English', forceroot=False, no_check=False, no_check_type=None, autocommit=True, full_repair=False, root_dir='/', version=None, plan=None, read_only=False):
     """
     Returns the appropriate type of editor for the given service. This allows
     for a more generalized approach in other scripts, as opposed to having to
     handle all of this there.
+
+    The editors' modules are only imported here, so that only the one which is
+    needed gets loaded.
+
+    If 'root_dir' is given, the editor modifies the system found under that
+    directory (e.g. a mounted disk image) instead of the running one. The
+    'version' is then the Darwin version of that system.
+
+    If a plan.Plan is given, the editor only records in it what it would do.
+    A read-only editor may read the current state, but not change it.
     """
 
     # Only return something if we have an editor for it!
     if service not in available_services:
         raise ValueError("Invalid service: " + str(service))
     else:
-        if service in tcc_services.available_services.keys():
+        if service in services.available_services.keys():
             # If it's in the TCC services, return a pre-formatted one of those.
+            import tcc_services
             return tcc_services.TCCEdit(
                 service         = service,
                 user            = user,
@@ -33,12 +66,23 @@ def get_editor(service, logger, user='', template=False, lang='English', forcero
                 logger          = logger,
                 forceroot       = forceroot,
                 no_check        = no_check,
-                no_check_type   = no_check_type
+                no_check_type   = no_check_type,
+                autocommit      = autocommit,
+                version         = version,
+                root_dir        = root_dir,
+                plan            = plan,
+                read_only       = read_only
             )
         else:
             # Otherwise, return an editor for Location Services.
+            import location_services
             return location_services.LSEdit(
                 logger          = logger,
                 no_check        = no_check,
-                no_check_type   = no_check_type
+                no_check_type   = no_check_type,
+                full_repair     = full_repair,
+                version         = version,
+                root_dir        = root_dir,
+                plan            = plan,
+                read_only       = read_only
             )
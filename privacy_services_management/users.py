@@ -0,0 +1,83 @@
+import os
+import universal
+
+# Where local home directories are kept.
+homes_dir = '/Users'
+
+# Directories in the homes directory which do not belong to a user.
+ignored_homes = ['Shared']
+
+def local_homes(directory=None):
+    """
+    Finds the home directories of all the local users. A directory counts as a
+    home if it contains a 'Library' folder.
+
+    :param directory: the directory holding the home folders (default '/Users')
+    :return: a list of (user, home) tuples, sorted by user
+    """
+    directory = directory or homes_dir
+    homes = []
+    for name in sorted(os.listdir(directory)):
+        home = os.path.join(directory, name)
+        if name.startswith('.') or name in ignored_homes:
+            continue
+        if os.path.isdir(os.path.join(home, 'Library')):
+            homes.append((name, home))
+    return homes
+
+def apply_all_users(services, action, apps, logger, directory=None, jobs=None, no_check=False, no_check_type=None, version=None, plan=None, golden=None):
+    """
+    Performs an action on TCC services for every local user. Each user's
+    database is modified by its own editor in a single transaction, and the
+    users are processed concurrently by a bounded pool of workers.
+
+    :param services: a list of TCC services stored in the users' local
+                     databases
+    :param action: one of the available actions
+    :param apps: a list of applications to modify
+    :param logger: a management_tools.loggers logger for recording output
+    :param directory: the directory holding the home folders (default '/Users')
+    :param jobs: the maximum number of users modified at once
+    :param version: the Darwin version of the system the users belong to, if
+                    it isn't the running one
+    :param plan: a plan.Plan to record the changes in instead of making them
+    :param golden: a golden database holding the same changes (see the 'golden'
+                   module), which is copied for users who have no database yet
+    :return: a list of (user, error) tuples, where 'error' is None if the user
+             was modified successfully
+    """
+    for service in services:
+        if universal.get_database(service) != 'local':
+            raise ValueError("Service '{}' is not stored per-user.".format(service))
+
+    import parallel
+    import tcc_services
+
+    def modify(home):
+        with tcc_services.TCCEdit(
+            service         = services[0],
+            logger          = logger,
+            home            = home[1],
+            no_check        = no_check,
+            no_check_type   = no_check_type,
+            autocommit      = False,
+            version         = version,
+            plan            = plan,
+            golden          = golden,
+        ) as e:
+            if e.provision():
+                return
+            for service in services:
+                getattr(e, universal.action_methods[action] + '_many')(apps, service)
+
+    homes = local_homes(directory)
+    logger.info("Modifying service(s) '{}' for {} user(s)...".format(', '.join(services), len(homes)))
+
+    results = []
+    for home, _, error in parallel.fan_out(modify, homes, jobs):
+        if error:
+            logger.error("Failed for user '{}': {}".format(home[0], error))
+        else:
+            logger.info("Modified user '{}' successfully.".format(home[0]))
+        results.append((home[0], error))
+    return results
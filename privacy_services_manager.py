@@ -4,23 +4,14 @@ import argparse
 import privacy_services_management as psm
 import sys
 
-# Check that management_tools is installed.
-try:
-    from management_tools import loggers
-    from management_tools.app_info import AppInfo
-except ImportError as e:
-    print("You need version 1.6.0 or greater of the 'Management Tools' module to be installed first.")
-    print("https://github.com/univ-of-utah-marriott-library-apple/management_tools")
-    raise e
-
-def main(apps, service, action, user, template, language, logger, forceroot, no_check, no_check_type):
+def main(apps, services, action, user, template, language, logger, forceroot, no_check, no_check_type, full_repair=False, plan=None):
     # Output some information.
     output = '#' * 80 + '\n' + version() + '''
     service:  {service}
     action:   {action}
     app(s):   {apps}
 '''.format(
-        service = service,
+        service = ', '.join(services),
         action  = action,
         apps    = apps
 )
@@ -38,11 +29,13 @@ def main(apps, service, action, user, template, language, logger, forceroot, no_
 )
     logger.info(output, print_out = False)
 
-    # Do the actual modifying of the services.
+    # Do the actual modifying of the services. The services are grouped by
+    # the database they're kept in, and each database is modified in a single
+    # transaction.
     if len(apps) == 0:
         apps.append(None)
-    with psm.universal.get_editor(
-        service         = service,
+    psm.manifest.apply(
+        entries         = [psm.manifest.validate(service, action, app) for service in services for app in apps],
         logger          = logger,
         user            = user,
         template        = template,
@@ -50,18 +43,9 @@ def main(apps, service, action, user, template, language, logger, forceroot, no_
         forceroot       = forceroot,
         no_check        = no_check,
         no_check_type   = no_check_type,
-    ) as e:
-        if action == 'add' or action == 'enable':
-            for app in apps:
-                e.insert(app)
-        elif action == 'remove':
-            for app in apps:
-                e.remove(app)
-        elif action == 'disable':
-            for app in apps:
-                e.disable(app)
-        else:
-            logger.error("Invalid action '" + action + "'.")
+        full_repair     = full_repair,
+        plan            = plan,
+    )
 
     # Notify of successful completion.
     logger.info("Successfully completed.")
@@ -85,8 +69,22 @@ def usage(short=False):
         print(version())
 
     print('''\
-usage: {name} [-hvn] [-l log] [-u user]
+usage: {name} [-hvn] [-l log] [-u user] [--plan]
          [--template] [--language] action service applications
+       {name} [-hvn] [-l log] [-u user] [--plan]
+         [--template] [--language] --manifest file
+       {name} [-hvn] [-l log] [-u user] [--plan]
+         [--template] [--language] --state file
+       {name} [-hvn] [-l log] [-j jobs] [--golden]
+         --all-users action service applications
+       {name} [-hvn] [-l log] [-j jobs] [-u user] [--template]
+         (--root dir | --image-glob pattern) ...
+         (action service applications | --manifest file)
+       {name} [-n] [-l log] [-u user] [--root dir] [--index]
+         (list | dump) [service] [clients]
+       {name} [-n] [-l log] [-u user] [--template] [--language]
+         check (service applications | --state file)
+       {name} [-n] [-l log] [--socket path] --serve
 
 Modify access to the various privacy services of OS X, such as Contacts, iCloud,
 Accessibility, Calendars, Reminders, and Locations.
@@ -104,6 +102,30 @@ Accessibility, Calendars, Reminders, and Locations.
     --forceroot
         Force the script to allow the creation or modification of the root
         user's own TCC database file.
+    --repair-ownership
+        When modifying Location Services, re-own everything in
+        /var/db/locationd instead of only the files which were changed.
+    --busy-timeout seconds
+        Wait up to 'seconds' for another process (such as tccd) to release a
+        lock on a TCC database before retrying. (Default: 1)
+    --lock-retries count
+        Retry a transaction on a locked TCC database up to 'count' times, with
+        a randomized delay between tries, before giving up. (Default: 5)
+    --timings
+        Measure how long each phase of the work takes (looking up applications,
+        creating and committing databases, and running external commands) and
+        log a summary as a single line of JSON at the end of the run.
+    --plan
+        Don't change anything. Instead, read the databases and property lists
+        (without writing to them) and log each entry which would be added,
+        updated, or removed, followed by a summary as a single line of JSON:
+        how many entries would change, how many times each external command
+        (launchctl, chown, codesign, ioreg) would run, how many commits would
+        be made, and which databases would be created.
+    --cache-uuid
+        Remember the hardware UUID (used to find the global Location Services
+        settings) between runs. Don't use this on a disk which will be imaged
+        to other machines.
     --no-check-app, --no-check-bin
         Enables administrative override, which allows you to modify services
         for non-bundled applications (such as binary programs used from the
@@ -113,13 +135,62 @@ Accessibility, Calendars, Reminders, and Locations.
             Use `--no-check-app` for applications, and `--no-check-bin` for
         binaries. (This distinction is actually very important.)
 
+    --serve
+        Run as a daemon, accepting requests from other invocations of this
+        program over a Unix domain socket. The daemon keeps the TCC databases
+        open and applications resolved between requests. Stop it with SIGTERM.
+    --socket path
+        The socket the daemon listens on. (Default:
+        /var/run/privacy_services_manager.sock when run as root)
+    --no-daemon
+        Do the work in this process even if a daemon is running. Otherwise,
+        an action given on the command line (on any number of services and
+        applications) is passed to the daemon if there is one. If the daemon
+        doesn't respond within 10 seconds, the work is done in this process.
+
     -l log, --log-dest log
         Redirect log output to 'log'.
     -u user, --user user
         Modify access only for 'user'. Only applies to certain services.
+    --all-users
+        Modify access for every local user with a home folder in /Users. Only
+        applies to the services stored in each user's own database. The users
+        are modified concurrently.
+    --golden
+        With --all-users, users who have no TCC database yet are given a copy
+        of a prebuilt database which already holds the changes, instead of
+        having one built and then modified. The prebuilt databases are kept
+        in the cache directory and rebuilt when the changes or the OS X
+        version change.
+    -j jobs, --jobs jobs
+        With --all-users, modify at most 'jobs' users at once. With --root or
+        --image-glob, modify at most 'jobs' systems at once. With --language
+        all, modify at most 'jobs' User Templates at once. (Default: 8)
+    --root dir
+        Modify the system found under 'dir' (e.g. a mounted disk image) instead
+        of the running one. Nothing is done to the running system's daemons.
+        May be given more than once; the systems are modified concurrently.
+    --image-glob pattern
+        Like --root, for every directory matching the shell pattern 'pattern'.
+        May be given more than once.
+    --manifest file
+        Read a list of operations from 'file' (or stdin, if 'file' is '-')
+        instead of the command line. Each operation gives a service, an action,
+        and an application, either as JSON objects or as one comma- or
+        whitespace-separated line per operation. All of the operations for each
+        database are applied in a single transaction.
+    --state file
+        Bring the services named in 'file' (or stdin, if 'file' is '-') into a
+        desired state, given as a JSON object which maps each service to the
+        applications it should 'allow' and 'deny'. If a service is marked
+        'exclusive', every other application is removed from it. Location
+        Services may also be 'enabled' or disabled globally. The current state
+        is read first, and only the differences are written; if there are none,
+        nothing is written at all.
     --language lang
         Only functions when used with --template. Specifies which User Template
-        is modified.\
+        is modified. Use 'all' to modify every localization of the User
+        Template; they are modified concurrently (see --jobs).\
 '''.format(name=psm.universal.attributes['name']))
 
     if not short:
@@ -136,8 +207,27 @@ ACTION
         Deauthorizes the applications from the service but leaves their entries
         in place. This is useful if you want to explicitly prevent an
         application from using a service.
+    list, dump
+        Writes every grant to stdout as a line of JSON, without changing
+        anything. Give a service (or several, separated by commas) to only
+        list those services, and bundle identifiers or paths to only list those
+        clients. With --user, only that user's database is listed. The
+        databases are read without taking any locks.
+            With --index, the grants are listed from an index of every
+        database instead, which is first brought up to date by reading only
+        the databases which have changed since it was last refreshed.
+    check
+        Checks that the applications are allowed in the service (or, with
+        --state, that the services are in the desired state), without changing
+        anything. Each mismatch is written to stdout, and the exit status is 4
+        if there were any. With 'location' and no applications, checks that
+        Location Services is enabled.
 
 SERVICE
+    Several services may be given at once, separated by commas (e.g.
+    'contacts,calendar,reminders'). Each database is then opened once and
+    modified in a single transaction.
+
     contacts
         Access to the AddressBook feature. Used by applications that want to
         know who you know.
@@ -177,6 +267,40 @@ APPLICATIONS
                 e.g. /Applications/Safari.app\
 ''')
 
+def daemon_available(args):
+    """
+    Checks whether the request can be passed to a running daemon. Options which
+    only affect this process (such as timings) are handled locally instead.
+
+    :param args: the parsed command line arguments
+    :return: whether a daemon is listening
+    """
+    if args.no_daemon or args.plan or args.timings or args.repair_ownership or args.cache_uuid:
+        return False
+    if args.template and args.language == 'all':
+        return False
+    if args.busy_timeout is not None or args.lock_retries is not None:
+        return False
+    import privacy_services_management.daemon
+    return psm.daemon.running(args.socket)
+
+def services(value):
+    """
+    Parses a comma-separated list of services from the command line.
+
+    :return: a list of services, without duplicates
+    """
+    result = []
+    for service in value.lower().split(','):
+        service = service.strip()
+        if service not in psm.universal.available_services:
+            raise argparse.ArgumentTypeError(
+                "invalid choice: '{}' (choose from {})".format(service, ', '.join(sorted(psm.universal.available_services)))
+            )
+        if service not in result:
+            result.append(service)
+    return result
+
 class ArgumentParser(argparse.ArgumentParser):
     """
     Custom argument parser for handling error messages nicely.
@@ -203,11 +327,27 @@ if __name__ == '__main__':
     parser.add_argument('--no-check-app', action='store_true')
     parser.add_argument('--no-check-bin', action='store_true')
     parser.add_argument('--admin', action='store_true', dest='no_check_bin')
+    parser.add_argument('--manifest')
+    parser.add_argument('--state')
+    parser.add_argument('--index', action='store_true')
+    parser.add_argument('--all-users', action='store_true')
+    parser.add_argument('--golden', action='store_true')
+    parser.add_argument('--repair-ownership', action='store_true')
+    parser.add_argument('--cache-uuid', action='store_true')
+    parser.add_argument('--timings', action='store_true')
+    parser.add_argument('--plan', action='store_true')
+    parser.add_argument('--serve', action='store_true')
+    parser.add_argument('--socket')
+    parser.add_argument('--no-daemon', action='store_true')
+    parser.add_argument('-j', '--jobs', type=int)
+    parser.add_argument('--busy-timeout', type=float)
+    parser.add_argument('--lock-retries', type=int)
+    parser.add_argument('--root', action='append', default=[])
+    parser.add_argument('--image-glob', action='append', default=[])
     parser.add_argument('action', nargs='?',
-                        choices=['add', 'remove', 'enable', 'disable'],
+                        choices=['add', 'remove', 'enable', 'disable', 'list', 'dump', 'check'],
                         default=None)
-    parser.add_argument('service', nargs='?',
-                        choices=psm.universal.available_services)
+    parser.add_argument('service', nargs='?', type=services)
     parser.add_argument('apps', nargs=argparse.REMAINDER)
     
     # Parse the arguments.
@@ -223,6 +363,15 @@ if __name__ == '__main__':
         print(version())
         sys.exit(0)
 
+    # Check that management_tools is installed. (This is only done now so that
+    # asking for help or the version doesn't have to wait for it to load.)
+    try:
+        from management_tools import loggers
+    except ImportError as e:
+        print("You need version 1.6.0 or greater of the 'Management Tools' module to be installed first.")
+        print("https://github.com/univ-of-utah-marriott-library-apple/management_tools")
+        raise e
+
     # Set up the logger.
     logger = loggers.get_logger(
         name = psm.universal.attributes['name'],
@@ -263,7 +412,7 @@ if __name__ == '__main__':
     ).format(
         bar      = '#' * 80,
         version  = version(),
-        service  = service,
+        service  = ', '.join(service) if service else None,
         action   = action,
         apps     = apps,
         user     = user if user else "N/A",
@@ -271,33 +420,273 @@ if __name__ == '__main__':
         language = language if template else "N/A"
     )
     
+    # Run as a daemon until told to stop.
+    if args.serve:
+        import privacy_services_management.daemon
+        try:
+            psm.daemon.serve(logger, args.socket)
+        except Exception:
+            logger.error(str(sys.exc_info()[0].__name__) + ": " + str(sys.exc_info()[1]))
+            sys.exit(3)
+        sys.exit(0)
+
+    # Reading waits for locks as long as writing does.
+    if args.busy_timeout is not None or args.lock_retries is not None:
+        import privacy_services_management.tcc_services
+        if args.busy_timeout is not None:
+            psm.tcc_services.default_busy_timeout = args.busy_timeout
+        if args.lock_retries is not None:
+            psm.tcc_services.default_lock_retries = args.lock_retries
+
+    # List the current grants without changing anything.
+    if args.action in ('list', 'dump'):
+        if args.manifest or args.state or args.all_users or args.template:
+            parser.error("Cannot give --manifest, --state, --all-users, or --template with '{}'.".format(args.action))
+        import privacy_services_management.grants
+        try:
+            roots = psm.images.find_roots(args.root, args.image_glob) or ['/']
+            if args.index:
+                import privacy_services_management.grant_index
+                with psm.grant_index.GrantIndex(logger) as index:
+                    for root in roots:
+                        index.refresh(root)
+                        psm.grants.write(index.query(
+                            services    = args.service,
+                            clients     = args.apps or None,
+                            user        = args.user,
+                            root_dir    = root
+                        ), sys.stdout)
+            else:
+                for root in roots:
+                    psm.grants.write(psm.grants.dump(
+                        logger      = logger,
+                        services    = args.service,
+                        clients     = args.apps or None,
+                        user        = args.user,
+                        root_dir    = root
+                    ), sys.stdout)
+        except Exception:
+            logger.error(str(sys.exc_info()[0].__name__) + ": " + str(sys.exc_info()[1]))
+            sys.exit(3)
+        sys.exit(0)
+
+    # Check the services against a policy without changing anything.
+    if args.action == 'check':
+        if args.manifest or args.all_users or args.root or args.image_glob or args.language == 'all':
+            parser.error("Cannot give --manifest, --all-users, --root, --image-glob, or --language all with 'check'.")
+        if not args.state and not args.service:
+            parser.error("Must specify a service or --state with 'check'.")
+        if args.state and args.service:
+            parser.error("Cannot give a service with --state.")
+        try:
+            if args.state:
+                state = psm.state.read(args.state)
+            else:
+                state = psm.state.required(args.service, args.apps)
+            mismatches = psm.state.check(
+                state           = state,
+                logger          = logger,
+                user            = args.user,
+                template        = args.template,
+                lang            = args.language,
+                forceroot       = args.forceroot,
+                no_check        = no_check,
+                no_check_type   = no_check_type
+            )
+        except Exception:
+            logger.error(str(sys.exc_info()[0].__name__) + ": " + str(sys.exc_info()[1]))
+            sys.exit(3)
+        for service, client, problem in mismatches:
+            print("{} {}: {}".format(service, client if client else '(global)', problem))
+        sys.exit(4 if mismatches else 0)
+
     # Perform checks for necessary bits of information.
-    if not args.action:
+    if args.manifest and args.state:
+        parser.error("Cannot give both --manifest and --state.")
+    if args.manifest or args.state:
+        if args.action or args.service:
+            parser.error("Cannot give an action or service with --manifest or --state.")
+    elif not args.action:
         print("Error: Must specify an action.")
         logger.error(output)
         sys.exit(1)
-    if not args.service:
+    elif not args.service:
         print("Error: Must specify a service to modify.")
         logger.error(output)
         sys.exit(1)
+    if args.all_users and (args.user or args.template or args.manifest):
+        parser.error("Cannot give --user, --template, or --manifest with --all-users.")
+    if args.language == 'all' and not args.template:
+        parser.error("Cannot give --language all without --template.")
+    if args.golden and not args.all_users:
+        parser.error("Cannot give --golden without --all-users.")
+    if args.all_users and (args.root or args.image_glob):
+        parser.error("Cannot give --root or --image-glob with --all-users.")
+    if args.state and (args.all_users or args.root or args.image_glob or args.language == 'all'):
+        parser.error("Cannot give --all-users, --root, --image-glob, or --language all with --state.")
+    if args.cache_uuid:
+        import privacy_services_management.location_services
+        psm.location_services.cache_uuid()
+    if args.timings:
+        psm.timings.enable()
+    plan = psm.plan.Plan() if args.plan else None
     if args.no_check_bin or args.no_check_app:
         logger.warn("Administrative override enabled. Be careful!")
         
     # Run the program!
     try:
         logger.info(output)
-        main(
-            apps            = args.apps if args.apps else [],
-            service         = args.service,
-            action          = args.action,
-            user            = args.user,
-            template        = args.template,
-            language        = args.language,
-            logger          = logger,
-            forceroot       = args.forceroot,
-            no_check        = no_check,
-            no_check_type   = no_check_type
-        )
+        if args.root or args.image_glob:
+            roots = psm.images.find_roots(args.root, args.image_glob)
+            if args.manifest:
+                entries = psm.manifest.read(args.manifest)
+            else:
+                entries = [
+                    psm.manifest.validate(service, args.action, app)
+                    for service in args.service
+                    for app in (args.apps or [None])
+                ]
+            logger.info("Applying {} operation(s) to {} system(s)...".format(len(entries), len(roots)))
+            results = psm.images.apply_roots(
+                roots           = roots,
+                entries         = entries,
+                logger          = logger,
+                jobs            = args.jobs,
+                user            = args.user,
+                template        = args.template,
+                lang            = args.language,
+                no_check        = no_check,
+                no_check_type   = no_check_type,
+                full_repair     = args.repair_ownership,
+                plan            = plan
+            )
+            failed = [root for root, error in results if error]
+            if failed:
+                raise RuntimeError("Failed to modify {} of {} system(s): {}".format(len(failed), len(results), ', '.join(failed)))
+            logger.info("Successfully completed for {} system(s).".format(len(results)))
+        elif args.template and args.language == 'all':
+            if args.manifest:
+                entries = psm.manifest.read(args.manifest)
+            else:
+                entries = [
+                    psm.manifest.validate(service, args.action, app)
+                    for service in args.service
+                    for app in (args.apps or [None])
+                ]
+            results = psm.templates.apply_all_languages(
+                entries         = entries,
+                logger          = logger,
+                jobs            = args.jobs,
+                no_check        = no_check,
+                no_check_type   = no_check_type,
+                plan            = plan
+            )
+            failed = [lang for lang, error in results if error]
+            if failed:
+                raise RuntimeError("Failed to modify {} of {} User Template(s): {}".format(len(failed), len(results), ', '.join(failed)))
+            logger.info("Successfully completed for {} User Template(s).".format(len(results)))
+        elif args.state:
+            state = psm.state.read(args.state)
+            logger.info("Read the desired state of {} service(s) from '{}'.".format(len(state), args.state))
+            changed = psm.state.reconcile(
+                state           = state,
+                logger          = logger,
+                user            = args.user,
+                template        = args.template,
+                lang            = args.language,
+                forceroot       = args.forceroot,
+                no_check        = no_check,
+                no_check_type   = no_check_type,
+                full_repair     = args.repair_ownership,
+                plan            = plan
+            )
+            if changed:
+                logger.info("Successfully brought the services into the desired state.")
+            else:
+                logger.info("The services were already in the desired state; nothing was written.")
+        elif args.manifest:
+            entries = psm.manifest.read(args.manifest)
+            logger.info("Read {} operation(s) from manifest '{}'.".format(len(entries), args.manifest))
+            psm.manifest.apply(
+                entries         = entries,
+                logger          = logger,
+                user            = args.user,
+                template        = args.template,
+                lang            = args.language,
+                forceroot       = args.forceroot,
+                no_check        = no_check,
+                no_check_type   = no_check_type,
+                full_repair     = args.repair_ownership,
+                plan            = plan
+            )
+            logger.info("Successfully completed.")
+        elif args.all_users:
+            golden = None
+            if args.golden and not plan:
+                import privacy_services_management.golden
+                golden = psm.golden.database(
+                    entries         = [psm.manifest.validate(service, args.action, app) for service in args.service for app in args.apps],
+                    logger          = logger,
+                    no_check        = no_check,
+                    no_check_type   = no_check_type
+                )
+            results = psm.users.apply_all_users(
+                services        = args.service,
+                action          = args.action,
+                apps            = args.apps,
+                logger          = logger,
+                jobs            = args.jobs,
+                no_check        = no_check,
+                no_check_type   = no_check_type,
+                plan            = plan,
+                golden          = golden
+            )
+            failed = [user for user, error in results if error]
+            if failed:
+                raise RuntimeError("Failed to modify {} of {} user(s): {}".format(len(failed), len(results), ', '.join(failed)))
+            logger.info("Successfully completed for {} user(s).".format(len(results)))
+        else:
+            response = None
+            if daemon_available(args):
+                import getpass
+                import socket
+                try:
+                    # The daemon runs as someone else, so "the current user"
+                    # is worked out here.
+                    response = psm.daemon.request({
+                        'service':          args.service,
+                        'action':           args.action,
+                        'apps':             args.apps,
+                        'user':             args.user or getpass.getuser(),
+                        'template':         args.template,
+                        'language':         args.language,
+                        'forceroot':        args.forceroot,
+                        'no_check':         no_check,
+                        'no_check_type':    no_check_type,
+                    }, args.socket)
+                except socket.error as e:
+                    logger.warn("The daemon did not respond ({}); doing the work here instead.".format(e))
+            if response:
+                if not response['ok']:
+                    raise RuntimeError("The daemon failed: " + response['error'])
+                logger.info("Successfully completed by the daemon in {}s.".format(response['elapsed']))
+            else:
+                main(
+                    apps            = args.apps if args.apps else [],
+                    services        = args.service,
+                    action          = args.action,
+                    user            = args.user,
+                    template        = args.template,
+                    language        = args.language,
+                    logger          = logger,
+                    forceroot       = args.forceroot,
+                    no_check        = no_check,
+                    no_check_type   = no_check_type,
+                    full_repair     = args.repair_ownership,
+                    plan            = plan
+                )
+        if plan:
+            plan.report(logger)
     except:
         message = (
             str(sys.exc_info()[0].__name__) + ": " +
@@ -305,3 +694,10 @@ if __name__ == '__main__':
         )
         logger.error(message)
         sys.exit(3)
+    finally:
+        # The TCC editor is only loaded if it was used.
+        tcc_services = getattr(psm, 'tcc_services', None)
+        if tcc_services and tcc_services.lock_stats.waited:
+            logger.info("Waited for database locks: {}.".format(tcc_services.lock_stats))
+        if psm.timings.enabled:
+            psm.timings.report(logger)